@@ -290,7 +290,9 @@ def cache():
 @click.option(
     "-ns",
     "--namespace",
-    type=click.Choice(["requests", "huggingface"]),
+    type=click.Choice(
+        ["requests", "huggingface", "storage", "datacite", "lakehouse", "ml"]
+    ),
     help="Limit cache cleaning to a namespace",
 )
 @click.option(
@@ -307,8 +309,13 @@ def cache_clean(namespace: Optional[str], name: Optional[str]):
 
 
 @cache.command(name="df", help="Calculate cache usage statistics")
-def cache_df():
-    cache_usage()
+@click.option(
+    "--reconcile",
+    is_flag=True,
+    help="Rescan the cache directories instead of relying on the size ledger",
+)
+def cache_df(reconcile: bool):
+    cache_usage(force_reconcile=reconcile)
 
 
 if __name__ == "__main__":
@@ -14,9 +14,15 @@ def export():
 @export.command(help="Export latest version of dataset from data mart")
 @click.argument("catalog", type=click.Choice(MART_SCHEMAS))
 @click.argument("schema")
-def dataset(catalog: str, schema: str):
+@click.option(
+    "--incremental",
+    "-i",
+    is_flag=True,
+    help="Only rewrite tables that changed since the latest export",
+)
+def dataset(catalog: str, schema: str, incremental: bool):
     lh = Lakehouse()
-    lh.export(catalog, schema)
+    lh.export(catalog, schema, incremental=incremental)
 
 
 @export.command(help="List exported datasets")
@@ -42,5 +48,12 @@ def prune():
     storage.prune()
 
 
+@export.command(help="Rebuild the manifest index from all exported dataset manifests")
+def reindex():
+    log.info("Rebuilding manifest index for exported datasets")
+    storage = Storage(prefix=StoragePrefix.EXPORTS)
+    storage.rebuild_index()
+
+
 if __name__ == "__main__":
     export()
@@ -27,7 +27,12 @@ def graph():
         "will be overwritten"
     ),
 )
-def load(schema: str, overwrite: bool):
+@click.option(
+    "--httpfs",
+    is_flag=True,
+    help="Read exported files directly from S3, via KùzuDB's httpfs extension",
+)
+def load(schema: str, overwrite: bool, httpfs: bool):
     graph_catalog = os.path.splitext(os.path.split(env.str("GRAPHS_MART_DB"))[-1])[0]
 
     log.info("Loading {}.{} into KùzuDB", graph_catalog, schema)
@@ -43,7 +48,7 @@ def load(schema: str, overwrite: bool):
     log.info("Latest export found at {}", s3_path)
 
     try:
-        ops = KuzuOps(schema, overwrite=overwrite)
+        ops = KuzuOps(schema, overwrite=overwrite, httpfs=httpfs)
 
         match schema:
             case "music_taste":
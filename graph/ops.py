@@ -1,10 +1,15 @@
+import os
+import re
 import shutil
 import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
 from pathlib import Path
 from string import Template
 from typing import Any, Optional
 
+import humanize
 import kuzu
 import numpy as np
 import pandas as pd
@@ -21,7 +26,7 @@ class KuzuTableType(Enum):
 
 
 class KuzuOps:
-    def __init__(self, schema: str, overwrite: bool = False):
+    def __init__(self, schema: str, overwrite: bool = False, httpfs: bool = False):
         dbname = env.str(f"{schema.upper()}_GRAPH_DB")
         db_path = Path(LOCAL_DIR) / dbname
 
@@ -38,13 +43,146 @@ class KuzuOps:
         db = kuzu.Database(db_path)
         self.conn = kuzu.Connection(db)
         self.storage = Storage(prefix=StoragePrefix.EXPORTS)
+        self.httpfs = httpfs
 
-    def _copy_from_s3(self, s3_path: str, query: str, path_var="path"):
-        with tempfile.NamedTemporaryFile(suffix=".parquet") as tmp:
-            self.storage.download_file(s3_path, tmp.name)
-            query = Template(query).substitute({path_var: tmp.name})
-            log.debug("Running query: {}", query)
-            self.conn.execute(query)
+    def _setup_httpfs(self):
+        log.info("Configuring KùzuDB httpfs for direct S3 reads")
+
+        self.conn.execute("INSTALL httpfs")
+        self.conn.execute("LOAD httpfs")
+
+        endpoint = env.str("S3_ENDPOINT", default=None)
+
+        # Same as Storage, as there's no separate setting for SSL
+        if endpoint is not None:
+            use_ssl = env.bool("S3_USE_SSL", default=True)
+            endpoint = f"https://{endpoint}" if use_ssl else f"http://{endpoint}"
+
+        s3_settings = dict(
+            s3_access_key_id=env.str("S3_ACCESS_KEY_ID"),
+            s3_secret_access_key=env.str("S3_SECRET_ACCESS_KEY"),
+            s3_endpoint=endpoint,
+            s3_url_style=env.str("S3_URL_STYLE", default=None),
+            s3_region=env.str("S3_REGION"),
+        )
+
+        # Endpoint and URL style are only required for MinIO, otherwise keep defaults
+        for name, value in s3_settings.items():
+            if value is not None:
+                self.conn.execute(f"CALL {name}='{value}'")
+
+    def _copy(
+        self,
+        description: str,
+        paths: list[str],
+        size: int,
+        query: str,
+        path_var: str,
+    ):
+        log.info(description)
+
+        # An explicit list of files, unlike a glob, is loaded in the given order
+        if len(paths) == 1:
+            path = f"'{paths[0]}'"
+        else:
+            path = "[" + ", ".join(f"'{path}'" for path in paths) + "]"
+
+        query = Template(query).substitute({path_var: path})
+        log.debug("Running query: {}", query)
+
+        start = time.perf_counter()
+        result = self.conn.execute(query)
+        elapsed = time.perf_counter() - start
+
+        message = result.get_as_df().iloc[0, 0]
+        match = re.match(r"(\d+) tuples", message)
+        rows = int(match.group(1)) if match else 0
+
+        log.info(
+            "Copied {} rows ({}) in {:.2f}s: {:.0f} rows/s, {}/s",
+            rows,
+            humanize.naturalsize(size),
+            elapsed,
+            rows / elapsed if elapsed > 0 else 0,
+            humanize.naturalsize(size / elapsed if elapsed > 0 else 0),
+        )
+
+    def _table_files(self, s3_path: str) -> list[str]:
+        # Size-capped or per-thread exports are split into a directory of files
+        s3_dir_path = s3_path.removesuffix(".parquet")
+
+        s3_file_paths = [
+            s3_file_path
+            for s3_file_path in self.storage.list_files(s3_dir_path)
+            if s3_file_path.endswith(".parquet")
+        ]
+
+        if len(s3_file_paths) == 0:
+            return [s3_path]
+
+        # DuckDB numbers each part (e.g., data_0.parquet, ..., data_10.parquet)
+        def part_number(s3_file_path: str) -> int:
+            match = re.search(r"(\d+)\.parquet$", s3_file_path)
+            return -1 if match is None else int(match.group(1))
+
+        return sorted(s3_file_paths, key=part_number)
+
+    def _copy_from_s3(self, copies: list[tuple[str, str, str]], path_var="path"):
+        """
+        Run a sequence of COPY queries, each reading from an S3 parquet file, or from
+        a directory of parquet files when the table was exported in multiple parts.
+
+        Args:
+            copies: List of (description, s3_path, query) tuples, where the query
+                contains a `$path` placeholder for the file, or list of files, to import.
+            path_var: Name of the placeholder variable within the query.
+        """
+
+        if self.httpfs:
+            self._setup_httpfs()
+
+            for description, s3_path, query in copies:
+                s3_file_paths = self._table_files(s3_path)
+                size = sum(self.storage.object_size(p) for p in s3_file_paths)
+
+                self._copy(description, s3_file_paths, size, query, path_var)
+
+            return
+
+        # Prefetch the next table while the current one is being imported
+        with (
+            tempfile.TemporaryDirectory(prefix="datalab-kuzu-") as tmp_dir,
+            ThreadPoolExecutor(max_workers=1) as executor,
+        ):
+
+            def fetch(i: int) -> list[str]:
+                local_dir = os.path.join(tmp_dir, str(i))
+                os.makedirs(local_dir)
+
+                local_paths = []
+
+                for j, s3_file_path in enumerate(self._table_files(copies[i][1])):
+                    local_path = os.path.join(local_dir, f"{j:06d}.parquet")
+                    self.storage.download_file(s3_file_path, local_path)
+                    local_paths.append(local_path)
+
+                return local_paths
+
+            future = executor.submit(fetch, 0) if len(copies) > 0 else None
+
+            for i, (description, _, query) in enumerate(copies):
+                local_paths = future.result()
+
+                if i + 1 < len(copies):
+                    future = executor.submit(fetch, i + 1)
+
+                local_dir = os.path.dirname(local_paths[0])
+
+                try:
+                    size = sum(os.path.getsize(path) for path in local_paths)
+                    self._copy(description, local_paths, size, query, path_var)
+                finally:
+                    shutil.rmtree(local_dir)
 
     # Graph: music_taste
     # ==================
@@ -118,66 +256,53 @@ class KuzuOps:
         self.conn.execute("CREATE REL TABLE Tagged(FROM Track TO Genre, MANY_MANY)")
 
     def _import_music_taste(self, s3_path: str):
-        # Nodes
-        # =====
-
-        log.info("Importing music_taste DSN User nodes")
-
-        self._copy_from_s3(
-            f"{s3_path}/nodes/dsn_nodes_users.parquet",
-            "COPY User(node_id, user_id, country, source) FROM '$path'",
-        )
-
-        log.info("Importing music_taste MSDSL User nodes")
-
-        self._copy_from_s3(
-            f"{s3_path}/nodes/msdsl_nodes_users.parquet",
-            "COPY User(node_id, user_id, source) FROM '$path'",
-        )
-
-        log.info("Importing music_taste MSDSL Track nodes")
-
-        self._copy_from_s3(
-            f"{s3_path}/nodes/msdsl_nodes_tracks.parquet",
-            "COPY Track(node_id, track_id, name, artist, year) FROM '$path'",
-        )
-
-        log.info("Importing music_taste Genre nodes")
-
-        self._copy_from_s3(
-            f"{s3_path}/nodes/nodes_genres.parquet",
-            "COPY Genre(node_id, genre) FROM '$path'",
-        )
-
-        # Edges
-        # =====
-
-        log.info("Importing music_taste DSN user-user friend edges")
-
-        self._copy_from_s3(
-            f"{s3_path}/edges/dsn_edges_friendships.parquet",
-            "COPY Friend FROM '$path'",
-        )
-
-        log.info("Importing music_taste DSN user-genre edges")
-
-        self._copy_from_s3(
-            f"{s3_path}/edges/dsn_edges_user_genres.parquet",
-            "COPY Likes FROM '$path'",
-        )
-
-        log.info("Importing music_taste MSDSL user-tracks edges")
-
-        self._copy_from_s3(
-            f"{s3_path}/edges/msdsl_edges_user_tracks.parquet",
-            "COPY ListenedTo FROM '$path'",
-        )
-
-        log.info("Importing music_taste MSDSL track-genres edges")
-
         self._copy_from_s3(
-            f"{s3_path}/edges/msdsl_edges_track_tags.parquet",
-            "COPY Tagged FROM '$path'",
+            [
+                # Nodes
+                # =====
+                (
+                    "Importing music_taste DSN User nodes",
+                    f"{s3_path}/nodes/dsn_nodes_users.parquet",
+                    "COPY User(node_id, user_id, country, source) FROM $path",
+                ),
+                (
+                    "Importing music_taste MSDSL User nodes",
+                    f"{s3_path}/nodes/msdsl_nodes_users.parquet",
+                    "COPY User(node_id, user_id, source) FROM $path",
+                ),
+                (
+                    "Importing music_taste MSDSL Track nodes",
+                    f"{s3_path}/nodes/msdsl_nodes_tracks.parquet",
+                    "COPY Track(node_id, track_id, name, artist, year) FROM $path",
+                ),
+                (
+                    "Importing music_taste Genre nodes",
+                    f"{s3_path}/nodes/nodes_genres.parquet",
+                    "COPY Genre(node_id, genre) FROM $path",
+                ),
+                # Edges
+                # =====
+                (
+                    "Importing music_taste DSN user-user friend edges",
+                    f"{s3_path}/edges/dsn_edges_friendships.parquet",
+                    "COPY Friend FROM $path",
+                ),
+                (
+                    "Importing music_taste DSN user-genre edges",
+                    f"{s3_path}/edges/dsn_edges_user_genres.parquet",
+                    "COPY Likes FROM $path",
+                ),
+                (
+                    "Importing music_taste MSDSL user-tracks edges",
+                    f"{s3_path}/edges/msdsl_edges_user_tracks.parquet",
+                    "COPY ListenedTo FROM $path",
+                ),
+                (
+                    "Importing music_taste MSDSL track-genres edges",
+                    f"{s3_path}/edges/msdsl_edges_track_tags.parquet",
+                    "COPY Tagged FROM $path",
+                ),
+            ]
         )
 
     def load_music_taste(self, path: str):
@@ -274,68 +399,61 @@ class KuzuOps:
         )
 
     def _import_econ_comp(self, s3_path: str):
-        # Nodes
-        # =====
-
-        log.info("Importing econ_comp Country nodes")
-
-        self._copy_from_s3(
-            f"{s3_path}/nodes/nodes_countries.parquet",
-            """
-            COPY Country(
-                node_id,
-                country_id,
-                country_iso3_code,
-                country_name,
-                country_name_short,
-                in_rankings,
-                former_country
-            ) FROM '$path'
-            """,
-        )
-
-        log.info("Importing econ_comp Product nodes")
-
-        self._copy_from_s3(
-            f"{s3_path}/nodes/nodes_products.parquet",
-            """
-            COPY Product(
-                node_id,
-                product_id,
-                product_hs92_code,
-                product_level,
-                product_name,
-                product_name_short,
-                product_id_hierarchy,
-                show_feasibility,
-                natural_resource,
-                green_product
-            ) FROM '$path'
-            """,
-        )
-
-        # Edges
-        # =====
-
-        log.info("Importing econ_comp country-country CompetesWith edges")
-
         self._copy_from_s3(
-            f"{s3_path}/edges/edges_competes_with.parquet",
-            "COPY CompetesWith FROM '$path'",
-        )
-
-        log.info("Importing econ_comp country->product Exports edges")
-
-        self._copy_from_s3(
-            f"{s3_path}/edges/edges_exports.parquet",
-            "COPY Exports FROM '$path'",
-        )
-
-        log.info("Importing econ_comp product->country Imports edges")
-
-        self._copy_from_s3(
-            f"{s3_path}/edges/edges_imports.parquet",
-            "COPY Imports FROM '$path'",
+            [
+                # Nodes
+                # =====
+                (
+                    "Importing econ_comp Country nodes",
+                    f"{s3_path}/nodes/nodes_countries.parquet",
+                    """
+                    COPY Country(
+                        node_id,
+                        country_id,
+                        country_iso3_code,
+                        country_name,
+                        country_name_short,
+                        in_rankings,
+                        former_country
+                    ) FROM $path
+                    """,
+                ),
+                (
+                    "Importing econ_comp Product nodes",
+                    f"{s3_path}/nodes/nodes_products.parquet",
+                    """
+                    COPY Product(
+                        node_id,
+                        product_id,
+                        product_hs92_code,
+                        product_level,
+                        product_name,
+                        product_name_short,
+                        product_id_hierarchy,
+                        show_feasibility,
+                        natural_resource,
+                        green_product
+                    ) FROM $path
+                    """,
+                ),
+                # Edges
+                # =====
+                (
+                    "Importing econ_comp country-country CompetesWith edges",
+                    f"{s3_path}/edges/edges_competes_with.parquet",
+                    "COPY CompetesWith FROM $path",
+                ),
+                (
+                    "Importing econ_comp country->product Exports edges",
+                    f"{s3_path}/edges/edges_exports.parquet",
+                    "COPY Exports FROM $path",
+                ),
+                (
+                    "Importing econ_comp product->country Imports edges",
+                    f"{s3_path}/edges/edges_imports.parquet",
+                    "COPY Imports FROM $path",
+                ),
+            ]
         )
 
     def load_econ_comp(self, path: str):
@@ -72,5 +72,12 @@ def prune():
     storage.prune()
 
 
+@ingest.command(help="Rebuild the manifest index from all ingested dataset manifests")
+def reindex():
+    log.info("Rebuilding manifest index for ingested datasets")
+    storage = Storage(prefix=StoragePrefix.INGEST)
+    storage.rebuild_index()
+
+
 if __name__ == "__main__":
     ingest()
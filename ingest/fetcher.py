@@ -1,22 +1,81 @@
 import os
-import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import nullcontext
+from dataclasses import dataclass
+from datetime import timedelta
 from pathlib import Path
+from typing import Any, Optional
 from urllib.parse import parse_qs, urljoin, urlsplit, urlunsplit
 
 import requests
 from loguru import logger as log
 from tqdm import tqdm
 
+from shared.cache import (
+    enforce_quota,
+    get_cache_dir,
+    get_requests_cache_session,
+    record_hit,
+    record_miss,
+    record_write,
+    touch,
+)
+from shared.settings import env
 from shared.storage import Storage, StoragePrefix
 
 DATACITE_API_URL = "https://api.datacite.org/"
 
+DOWNLOAD_MAX_WORKERS = env.int("DOWNLOAD_MAX_WORKERS", 4)
+DOWNLOAD_MAX_RETRIES = env.int("DOWNLOAD_MAX_RETRIES", 5)
+DOWNLOAD_BACKOFF_SECONDS = env.float("DOWNLOAD_BACKOFF_SECONDS", 2.0)
+DOWNLOAD_TIMEOUT_SECONDS = env.float("DOWNLOAD_TIMEOUT_SECONDS", 60.0)
+
+DATACITE_CACHE_TTL_HOURS = env.int("DATACITE_CACHE_TTL_HOURS", 24)
+DATACITE_CACHE_FILES = env.bool("DATACITE_CACHE_FILES", False)
+
+
+@dataclass
+class DataverseFile:
+    file_id: int
+    filename: str
+    size: int
+    checksum: Optional[str]
+
+    @property
+    def metadata(self) -> dict[str, Any]:
+        return dict(file_id=self.file_id, size=self.size, checksum=self.checksum)
+
 
 class DataCiteFetcher:
-    def __init__(self, s3_dir_path: str):
+    def __init__(
+        self,
+        s3_dir_path: str,
+        previous_manifest: Optional[dict[str, Any]] = None,
+    ):
         self.s3_dir_path = s3_dir_path
         self.storage = Storage(StoragePrefix.INGEST)
-        self.session = requests.Session()
+        self.session = get_requests_cache_session(
+            "datacite",
+            expire_after=timedelta(hours=DATACITE_CACHE_TTL_HOURS),
+        )
+        self._thread_local = threading.local()
+
+        previous_manifest = previous_manifest or {}
+        self.previous_latest = previous_manifest.get("latest")
+        self.previous_files = previous_manifest.get("files", {})
+        self.files = {}
+
+        self.files_cache_dir = get_cache_dir() / "datacite" / "files"
+
+    @property
+    def download_session(self) -> requests.Session:
+        # Sessions are not guaranteed to be thread-safe, so each worker gets its own
+        if not hasattr(self._thread_local, "session"):
+            self._thread_local.session = requests.Session()
+
+        return self._thread_local.session
 
     def to_canonical_doi(self, doi: str) -> str:
         rel_path = urlsplit(doi).path.removeprefix("/")
@@ -33,7 +92,7 @@ class DataCiteFetcher:
 
         return ds_url
 
-    def get_files_list(self, ds_url: str) -> list[tuple[int, str]]:
+    def get_files_list(self, ds_url: str) -> list[DataverseFile]:
         ds_url_parts = urlsplit(ds_url)
         ds_persistent_id = parse_qs(ds_url_parts.query)["persistentId"][0]
 
@@ -58,50 +117,189 @@ class DataCiteFetcher:
             if "dataFile" not in ds_file:
                 continue
 
-            file_id = ds_file["dataFile"]["id"]
-            filename = ds_file["dataFile"]["filename"]
-
-            files.append((file_id, filename))
+            files.append(
+                DataverseFile(
+                    file_id=ds_file["dataFile"]["id"],
+                    filename=ds_file["dataFile"]["filename"],
+                    size=ds_file["dataFile"].get("filesize", 0),
+                    checksum=ds_file["dataFile"].get("checksum", {}).get("value"),
+                )
+            )
 
         return files
 
-    def download_file(self, ds_url: str, file_id: int) -> str:
-        with tempfile.NamedTemporaryFile(delete=False) as tmp:
-            ds_url_parts = urlsplit(ds_url)
+    def cached_file_path(self, ds_file: DataverseFile) -> Optional[Path]:
+        if not DATACITE_CACHE_FILES or ds_file.checksum is None:
+            return
 
-            ds_api_url = urlunsplit(
-                (
-                    ds_url_parts.scheme,
-                    ds_url_parts.netloc,
-                    f"/api/access/datafile/{file_id}",
-                    None,
-                    None,
-                )
+        return self.files_cache_dir / f"{ds_file.file_id}_{ds_file.checksum}"
+
+    def download_file(
+        self,
+        ds_url: str,
+        ds_file: DataverseFile,
+        s3_target_path: str,
+    ):
+        """
+        Stream a Dataverse file straight into S3, resuming on dropped connections.
+
+        Downloaded bytes are written into a multipart upload as they arrive. When the
+        connection drops, or the server fails transiently (5xx or 429), the download is
+        resumed from the last received byte, using an HTTP Range request. Retries are
+        only exhausted by consecutive failures, without any progress in between. If
+        file caching is enabled, bytes are also written into the local cache, keyed
+        by file ID and checksum.
+        """
+
+        file_id = ds_file.file_id
+        filename = ds_file.filename
+        cache_path = self.cached_file_path(ds_file)
+
+        if cache_path is not None:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_cache_path = cache_path.with_suffix(".part")
+
+        ds_url_parts = urlsplit(ds_url)
+
+        ds_api_url = urlunsplit(
+            (
+                ds_url_parts.scheme,
+                ds_url_parts.netloc,
+                f"/api/access/datafile/{file_id}",
+                None,
+                None,
             )
+        )
+
+        log.info("Downloading {} from {} to {}", file_id, ds_api_url, s3_target_path)
 
-            log.info("Downloading {} to {}", file_id, ds_api_url, tmp.name)
+        offset = 0
+        attempt = 0
 
-            with self.session.get(ds_api_url, stream=True) as r:
-                r.raise_for_status()
+        try:
+            with (
+                self.storage.multipart_writer(s3_target_path) as writer,
+                (
+                    nullcontext() if cache_path is None else open(tmp_cache_path, "wb")
+                ) as cache_fp,
+                tqdm(unit="B", unit_scale=True, unit_divisor=1024, desc=filename) as pb,
+            ):
+                while True:
+                    headers = {} if offset == 0 else {"Range": f"bytes={offset}-"}
+                    resume_offset = offset
+
+                    try:
+                        with self.download_session.get(
+                            ds_api_url,
+                            headers=headers,
+                            stream=True,
+                            timeout=DOWNLOAD_TIMEOUT_SECONDS,
+                        ) as r:
+                            r.raise_for_status()
+
+                            # Servers ignoring the Range header resend the whole file
+                            skip = offset if r.status_code != 206 else 0
+
+                            if pb.total is None:
+                                pb.total = offset + int(
+                                    r.headers.get("content-length", 0)
+                                )
+                                pb.refresh()
+
+                            for chunk in r.iter_content(chunk_size=262144):
+                                if skip > 0:
+                                    skipped = min(skip, len(chunk))
+                                    chunk = chunk[skipped:]
+                                    skip -= skipped
+
+                                if chunk:
+                                    writer.write(chunk)
+
+                                    if cache_fp is not None:
+                                        cache_fp.write(chunk)
+
+                                    offset += len(chunk)
+                                    pb.update(len(chunk))
+
+                        break
+
+                    except (
+                        requests.exceptions.ConnectionError,
+                        requests.exceptions.ChunkedEncodingError,
+                        requests.exceptions.Timeout,
+                        requests.exceptions.HTTPError,
+                    ) as e:
+                        status_code = getattr(e.response, "status_code", None)
+
+                        # The range starts at the end, so every byte was received
+                        if status_code == 416 and offset > 0 and offset == pb.total:
+                            break
+
+                        if isinstance(e, requests.exceptions.HTTPError) and not (
+                            status_code == 429 or status_code >= 500
+                        ):
+                            raise
+
+                        # Only consecutive interruptions, without progress, count
+                        if offset > resume_offset:
+                            attempt = 0
+
+                        attempt += 1
+
+                        if attempt > DOWNLOAD_MAX_RETRIES:
+                            raise
 
-                total_size = int(r.headers.get("content-length", 0))
+                        backoff = DOWNLOAD_BACKOFF_SECONDS * 2 ** (attempt - 1)
 
-                with (
-                    open(tmp.name, "wb") as fp,
-                    tqdm(
-                        total=total_size,
-                        unit="B",
-                        unit_scale=True,
-                        unit_divisor=1024,
-                        desc=tmp.name,
-                    ) as pb,
-                ):
-                    for chunk in r.iter_content(chunk_size=262144):
-                        if chunk is not None:
-                            fp.write(chunk)
-                            pb.update(len(chunk))
+                        log.warning(
+                            "Download of {} interrupted at byte {} (attempt {}/{}), "
+                            "resuming in {}s: {}",
+                            filename,
+                            offset,
+                            attempt,
+                            DOWNLOAD_MAX_RETRIES,
+                            backoff,
+                            e,
+                        )
 
-            return tmp.name
+                        time.sleep(backoff)
+
+        except BaseException:
+            # Never leave a partial download behind in the cache
+            if cache_path is not None:
+                tmp_cache_path.unlink(missing_ok=True)
+
+            raise
+
+        if cache_path is not None:
+            os.replace(tmp_cache_path, cache_path)
+            record_write("datacite", offset)
+
+    def fetch_file(self, ds_url: str, ds_file: DataverseFile, s3_target_path: str):
+        rel_path = s3_target_path.removeprefix(f"{self.s3_dir_path}/")
+        previous_metadata = self.previous_files.get(rel_path)
+
+        cache_path = self.cached_file_path(ds_file)
+
+        if (
+            ds_file.checksum is not None
+            and self.previous_latest is not None
+            and previous_metadata == ds_file.metadata
+        ):
+            log.info("Unchanged, copying from previous ingestion: {}", rel_path)
+            self.storage.copy(f"{self.previous_latest}/{rel_path}", s3_target_path)
+        elif cache_path is not None and cache_path.exists():
+            log.info("Cache hit, uploading from local cache: {}", cache_path)
+            record_hit("datacite")
+            touch(cache_path)
+            self.storage.upload_file(str(cache_path), s3_target_path)
+        else:
+            if cache_path is not None:
+                record_miss("datacite")
+
+            self.download_file(ds_url, ds_file, s3_target_path)
+
+        self.files[rel_path] = ds_file.metadata
 
     def download(self, doi: str, target: Path):
         log.info("Processing DOI: {}", doi)
@@ -112,9 +310,34 @@ class DataCiteFetcher:
         log.info("Getting files from {}", ds_url)
         files = self.get_files_list(ds_url)
 
-        for file_id, filename in files:
-            try:
-                tmp_path = self.download_file(ds_url, file_id)
-                self.storage.upload_file(tmp_path, f"{target}/{filename}")
-            finally:
-                os.unlink(tmp_path)
+        log.info(
+            "Downloading {} files using {} workers", len(files), DOWNLOAD_MAX_WORKERS
+        )
+
+        failed = []
+
+        with ThreadPoolExecutor(max_workers=DOWNLOAD_MAX_WORKERS) as executor:
+            futures = {
+                executor.submit(
+                    self.fetch_file,
+                    ds_url,
+                    ds_file,
+                    f"{target}/{ds_file.filename}",
+                ): ds_file.filename
+                for ds_file in files
+            }
+
+            for future in as_completed(futures):
+                filename = futures[future]
+
+                try:
+                    future.result()
+                except Exception as e:
+                    log.error("Could not download {}: {}", filename, e)
+                    failed.append(filename)
+
+        if DATACITE_CACHE_FILES:
+            enforce_quota("datacite")
+
+        if len(failed) > 0:
+            raise IOError(f"{len(failed)} out of {len(files)} downloads failed")
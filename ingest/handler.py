@@ -7,7 +7,15 @@ from loguru import logger as log
 from ingest.fetcher import DataCiteFetcher
 from ingest.parser import DatasetURL
 from ingest.template.base import DataCiteTemplate, DatasetTemplate, DatasetTemplateID
-from shared.cache import get_cache_dir
+from shared.cache import (
+    dir_size,
+    enforce_quota,
+    get_cache_dir,
+    record_hit,
+    record_miss,
+    record_write,
+    touch,
+)
 from shared.storage import Storage, StoragePrefix
 from shared.utils import fn_sanitize
 
@@ -36,6 +44,7 @@ def handle_template(dataset: str, template_id: DatasetTemplateID):
 
     try:
         s = Storage(prefix=StoragePrefix.INGEST)
+        previous_manifest = s.load_manifest(ds_name)
         s3_dir_path = s.get_dir(ds_name, dated=True, upload_placeholder=True)
         s.upload_manifest(ds_name, latest=s3_dir_path)
     except Exception as e:
@@ -44,12 +53,14 @@ def handle_template(dataset: str, template_id: DatasetTemplateID):
 
     match template:
         case DataCiteTemplate():
-            dcdl = DataCiteFetcher(s3_dir_path)
+            dcdl = DataCiteFetcher(s3_dir_path, previous_manifest=previous_manifest)
 
             for source, target, attribution in template:
                 log.info("Downloading: {}", attribution.replace("\n", " ").strip())
                 dcdl.download(doi=source, target=f"{s3_dir_path}/{target}")
 
+            s.upload_manifest(ds_name, latest=s3_dir_path, files=dcdl.files)
+
 
 def handle_kaggle(dataset_url: str):
     ds_url = DatasetURL.parse(dataset_url)
@@ -59,8 +70,12 @@ def handle_kaggle(dataset_url: str):
         kaggle_ds_path = kh.dataset_download(ds_url.handle)
         s = Storage(prefix=StoragePrefix.INGEST)
         s3_dir_path = s.get_dir(ds_url.name, dated=True)
-        s.upload_dir(source_path=kaggle_ds_path, s3_target_path=s3_dir_path)
-        s.upload_manifest(ds_url.name, latest=s3_dir_path)
+        files = s.sync_dir(
+            ds_name=ds_url.name,
+            source_path=kaggle_ds_path,
+            s3_target_path=s3_dir_path,
+        )
+        s.upload_manifest(ds_url.name, latest=s3_dir_path, files=files)
     except:
         log.exception(
             "Couldn't download dataset. You might need to setup "
@@ -78,7 +93,12 @@ def handle_hugging_face(dataset_url: str):
 
         log.info("Fetching {}", dataset_url)
 
-        if not hf_ds_path.exists():
+        if hf_ds_path.exists():
+            record_hit("huggingface")
+            touch(hf_ds_path)
+        else:
+            record_miss("huggingface")
+
             log.info("Cloning {}", dataset_url)
             git.Repo.clone_from(dataset_url, hf_ds_path)
 
@@ -89,9 +109,17 @@ def handle_hugging_face(dataset_url: str):
                 else:
                     git_file_path.unlink()
 
+            record_write("huggingface", dir_size(hf_ds_path))
+
         s = Storage(prefix=StoragePrefix.INGEST)
         s3_dir_path = s.get_dir(ds_url.name, dated=True)
-        s.upload_dir(source_path=hf_ds_path, s3_target_path=s3_dir_path)
-        s.upload_manifest(ds_url.name, latest=s3_dir_path)
+        files = s.sync_dir(
+            ds_name=ds_url.name,
+            source_path=hf_ds_path,
+            s3_target_path=s3_dir_path,
+        )
+        s.upload_manifest(ds_url.name, latest=s3_dir_path, files=files)
+
+        enforce_quota("huggingface")
     except Exception as e:
         log.exception("Couldn't download dataset: {}", e)
@@ -0,0 +1,301 @@
+import asyncio
+import itertools
+import math
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+
+from loguru import logger as log
+
+from ml.inference import ModelNotFound, predict_batch, select_model
+from ml.registry import init_model_registry, model_registry
+from ml.types import InferenceModel, InferenceRequest, InferenceResult
+from shared.settings import env
+
+INFERENCE_BATCH_MAX_SIZE = env.int("INFERENCE_BATCH_MAX_SIZE", 64)
+INFERENCE_BATCH_MAX_WAIT_MS = env.float("INFERENCE_BATCH_MAX_WAIT_MS", 5.0)
+
+INFERENCE_EXECUTOR = env.str("INFERENCE_EXECUTOR", "thread")
+INFERENCE_MAX_WORKERS = env.int("INFERENCE_MAX_WORKERS", 4)
+INFERENCE_MODEL_MAX_CONCURRENCY = env.int("INFERENCE_MODEL_MAX_CONCURRENCY", 2)
+INFERENCE_MODEL_MAX_PENDING = env.int("INFERENCE_MODEL_MAX_PENDING", 1024)
+
+
+class InferenceQueueFull(Exception):
+    def __init__(self, retry_after: int):
+        super().__init__(f"Inference queue is full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+@dataclass
+class PendingInference:
+    inference_request: InferenceRequest
+    future: asyncio.Future
+
+
+class InferenceBatcher:
+    """
+    Collect concurrent inference requests per model, for up to max_wait_ms or
+    until max_size requests are pending, and run them as a single batch.
+
+    Batches run on a thread or process pool, outside the event loop, with at most
+    max_concurrency batches per model at once. Once max_pending requests are
+    waiting for a model, new requests are rejected with InferenceQueueFull.
+    """
+
+    def __init__(
+        self,
+        max_size: int = INFERENCE_BATCH_MAX_SIZE,
+        max_wait_ms: float = INFERENCE_BATCH_MAX_WAIT_MS,
+        max_concurrency: int = INFERENCE_MODEL_MAX_CONCURRENCY,
+        max_pending: int = INFERENCE_MODEL_MAX_PENDING,
+    ):
+        self.max_size = max_size
+        self.max_wait = max_wait_ms / 1000
+        self.max_concurrency = max_concurrency
+        self.max_pending = max_pending
+
+        match INFERENCE_EXECUTOR:
+            case "thread":
+                self.executor: Executor = ThreadPoolExecutor(INFERENCE_MAX_WORKERS)
+            case "process":
+                # Each worker process keeps its own model registry
+                self.executor = ProcessPoolExecutor(
+                    INFERENCE_MAX_WORKERS,
+                    initializer=init_model_registry,
+                )
+            case _:
+                raise ValueError(
+                    f"Unsupported inference executor: {INFERENCE_EXECUTOR}"
+                )
+
+        self.pending: dict[tuple[str, str], list[PendingInference]] = {}
+        self.timers: dict[tuple[str, str], asyncio.TimerHandle] = {}
+        self.tasks: set[asyncio.Task] = set()
+
+        self.semaphores: dict[tuple[str, str], asyncio.Semaphore] = {}
+        self.waiting: dict[tuple[str, str], int] = {}
+        self.batch_seconds: dict[tuple[str, str], float] = {}
+
+    async def start(self):
+        if isinstance(self.executor, ThreadPoolExecutor):
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(self.executor, init_model_registry)
+
+    def close(self):
+        if isinstance(self.executor, ThreadPoolExecutor):
+            model_registry.stop()
+
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def retry_after(self, key: tuple[str, str]) -> int:
+        """Estimate how many seconds it will take to drain the queue for a model."""
+
+        num_batches = math.ceil(self.waiting.get(key, 0) / self.max_size)
+        seconds = num_batches * self.batch_seconds.get(key, 1.0) / self.max_concurrency
+
+        return max(1, math.ceil(seconds))
+
+    async def predict(self, inference_request: InferenceRequest) -> InferenceResult:
+        loop = asyncio.get_running_loop()
+
+        inference_request.validate()
+
+        inference_model = select_model(inference_request)
+        key = (inference_model.name, inference_model.version)
+
+        if self.waiting.get(key, 0) >= self.max_pending:
+            raise InferenceQueueFull(self.retry_after(key))
+
+        future = loop.create_future()
+        batch = self.pending.setdefault(key, [])
+        batch.append(PendingInference(inference_request, future))
+
+        if len(batch) >= self.max_size:
+            self._flush(key)
+        elif key not in self.timers:
+            self.timers[key] = loop.call_later(self.max_wait, self._flush, key)
+
+        self.waiting[key] = self.waiting.get(key, 0) + 1
+
+        try:
+            return await future
+        finally:
+            self.waiting[key] -= 1
+
+    async def predict_many(
+        self, inference_requests: list[InferenceRequest]
+    ) -> list[InferenceResult | Exception]:
+        """
+        Run batches of up to max_size requests per selected model, bypassing the
+        batching window, and return one result per request, in the same order.
+
+        Failed requests are returned as their exception, instead of a result, so
+        that they don't discard the results of other requests or chunks.
+        """
+
+        groups: dict[tuple[str, str], list[int]] = {}
+
+        for inference_request in inference_requests:
+            inference_request.validate()
+
+        for i, inference_request in enumerate(inference_requests):
+            inference_model = select_model(inference_request)
+            key = (inference_model.name, inference_model.version)
+            groups.setdefault(key, []).append(i)
+
+        for key, indices in groups.items():
+            if self.waiting.get(key, 0) + len(indices) > self.max_pending:
+                raise InferenceQueueFull(self.retry_after(key))
+
+        for key, indices in groups.items():
+            self.waiting[key] = self.waiting.get(key, 0) + len(indices)
+
+        chunks = [
+            (key, chunk)
+            for key, indices in groups.items()
+            for chunk in itertools.batched(indices, self.max_size)
+        ]
+
+        released = set()
+
+        async def run_chunk(j: int) -> list[InferenceResult | Exception]:
+            key, chunk = chunks[j]
+
+            try:
+                return await self._execute_isolated(
+                    InferenceModel(*key),
+                    [inference_requests[i] for i in chunk],
+                )
+            finally:
+                # Release each chunk as it completes, so that retry hints stay accurate
+                self.waiting[key] -= len(chunk)
+                released.add(j)
+
+        try:
+            chunk_results = await asyncio.gather(
+                *(run_chunk(j) for j in range(len(chunks)))
+            )
+        finally:
+            # Chunks that were cancelled before starting are released here
+            for j, (key, chunk) in enumerate(chunks):
+                if j not in released:
+                    self.waiting[key] -= len(chunk)
+
+        inference_results = [None] * len(inference_requests)
+
+        for (_, chunk), results in zip(chunks, chunk_results):
+            for i, inference_result in zip(chunk, results):
+                inference_results[i] = inference_result
+
+        return inference_results
+
+    def _flush(self, key: tuple[str, str]):
+        timer = self.timers.pop(key, None)
+
+        if timer is not None:
+            timer.cancel()
+
+        batch = self.pending.pop(key, [])
+
+        if len(batch) == 0:
+            return
+
+        task = asyncio.create_task(self._run(InferenceModel(*key), batch))
+
+        # Keep a reference, so that the task isn't garbage collected while running
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _run(
+        self, inference_model: InferenceModel, batch: list[PendingInference]
+    ):
+        log.debug(
+            "Running batch of {} requests for {}/{}",
+            len(batch),
+            inference_model.name,
+            inference_model.version,
+        )
+
+        inference_results = await self._execute_isolated(
+            inference_model,
+            [pending.inference_request for pending in batch],
+        )
+
+        for pending, inference_result in zip(batch, inference_results):
+            if pending.future.done():
+                continue
+
+            if isinstance(inference_result, BaseException):
+                pending.future.set_exception(inference_result)
+            else:
+                pending.future.set_result(inference_result)
+
+    async def _execute_isolated(
+        self,
+        inference_model: InferenceModel,
+        inference_requests: list[InferenceRequest],
+    ) -> list[InferenceResult | Exception]:
+        """
+        Run a batch, returning one result or exception per request. When the batch
+        fails, each request is retried on its own, so that a bad request doesn't
+        fail the other requests in its batch.
+        """
+
+        try:
+            return await self._execute(inference_model, inference_requests)
+        except Exception as e:
+            if isinstance(e, ModelNotFound) or len(inference_requests) == 1:
+                return [e] * len(inference_requests)
+
+            log.warning(
+                "Batch failed for {}/{}, retrying each request: {}",
+                inference_model.name,
+                inference_model.version,
+                e,
+            )
+
+        inference_results = await asyncio.gather(
+            *(
+                self._execute(inference_model, [inference_request])
+                for inference_request in inference_requests
+            ),
+            return_exceptions=True,
+        )
+
+        return [
+            (
+                inference_result
+                if isinstance(inference_result, BaseException)
+                else inference_result[0]
+            )
+            for inference_result in inference_results
+        ]
+
+    async def _execute(
+        self,
+        inference_model: InferenceModel,
+        inference_requests: list[InferenceRequest],
+    ) -> list[InferenceResult]:
+        loop = asyncio.get_running_loop()
+        key = (inference_model.name, inference_model.version)
+        semaphore = self.semaphores.setdefault(
+            key,
+            asyncio.Semaphore(self.max_concurrency),
+        )
+
+        async with semaphore:
+            start = loop.time()
+
+            inference_results = await loop.run_in_executor(
+                self.executor,
+                predict_batch,
+                inference_model,
+                inference_requests,
+            )
+
+            # Exponential moving average of the batch duration, for retry hints
+            elapsed = loop.time() - start
+            previous = self.batch_seconds.get(key, elapsed)
+            self.batch_seconds[key] = 0.8 * previous + 0.2 * elapsed
+
+        return inference_results
@@ -66,6 +66,29 @@ async def queue_inference_result(
         log.error(f"Delivery failed for inference result: {e}")
 
 
+async def queue_inference_results(
+    producer: AIOKafkaProducer,
+    inference_results: list[InferenceResult],
+):
+    """Enqueue all results before waiting, so they're delivered as batched sends."""
+
+    try:
+        deliveries = [
+            await producer.send(
+                INFERENCE_RESULTS_TOPIC,
+                key=inference_result.inference_uuid.encode("utf-8"),
+                value=json.dumps(asdict(inference_result)).encode("utf-8"),
+            )
+            for inference_result in inference_results
+        ]
+
+        await asyncio.gather(*deliveries)
+
+        log.info("Successfully delivered {} inference results", len(deliveries))
+    except Exception as e:
+        log.error(f"Delivery failed for inference results: {e}")
+
+
 async def queue_inference_feedback(
     producer: AIOKafkaProducer,
     inference_feedback: InferenceFeedback,
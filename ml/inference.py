@@ -1,51 +1,78 @@
 import random
 from uuid import uuid4
 
-import mlflow
-from joblib import Memory
+import numpy as np
+import pandas as pd
 from loguru import logger as log
-from mlflow.exceptions import RestException
 
-from ml.types import InferenceModel, InferenceRequest, InferenceResult
-from shared.cache import get_cache_dir
+from ml.registry import ModelNotFound, model_registry, parse_model_uri
+from ml.types import (
+    InferenceModel,
+    InferenceRequest,
+    InferenceResult,
+    InvalidInferenceRequest,
+)
 
-memory = Memory(get_cache_dir() / "ml/models", verbose=0)
-memory.clear(warn=False)
 
+def load_model(model_uri: str):
+    return model_registry.get(parse_model_uri(model_uri))
 
-class ModelNotFound(Exception):
-    pass
 
+def select_model(inference_request: InferenceRequest) -> InferenceModel:
+    if type(inference_request.models) is InferenceModel:
+        return inference_request.models
 
-@memory.cache
-def load_model(model_uri: str):
-    try:
-        return mlflow.sklearn.load_model(model_uri)
-    except RestException:
-        raise ModelNotFound(model_uri)
+    if len(inference_request.models) == 0:
+        raise InvalidInferenceRequest("At least one model must be given")
 
+    log.debug("Randomly selecting a model")
+    return random.choice(inference_request.models)
 
-def predict(inference_request: InferenceRequest) -> InferenceResult:
-    if type(inference_request.models) is InferenceModel:
-        inference_model = inference_request.models
-    else:
-        log.debug("Randomly selecting a model")
-        inference_model = random.choice(inference_request.models)
+
+def predict_batch(
+    inference_model: InferenceModel,
+    inference_requests: list[InferenceRequest],
+) -> list[InferenceResult]:
+    """
+    Run a single vectorized inference for several requests to the same model,
+    returning one result per request (i.e., per input row), in the same order.
+    """
 
     model_uri = f"models:/{inference_model.name}/{inference_model.version}"
-    model = load_model(model_uri)
+    model = model_registry.get(inference_model)
 
-    log.info("Running inference using {}", model_uri)
+    log.info(
+        "Running inference using {} for {} requests",
+        model_uri,
+        len(inference_requests),
+    )
+
+    inputs = [inference_request.get_input() for inference_request in inference_requests]
+    data = pd.concat(inputs, ignore_index=True)
 
-    data = inference_request.get_input()
     pos_class_idx = model.classes_.tolist().index(1)
-    prediction = model.predict_proba(data)[0, pos_class_idx].item()
+    predictions = model.predict_proba(data)[:, pos_class_idx]
 
-    inference_result = InferenceResult(
-        inference_uuid=str(uuid4()),
-        model=inference_model,
-        data=inference_request.data,
-        prediction=prediction,
-    )
+    # Each request maps to its own slice of rows (a single row, per get_input)
+    bounds = np.cumsum([0] + [len(input_) for input_ in inputs])
+
+    inference_results = [
+        InferenceResult(
+            inference_uuid=str(uuid4()),
+            model=inference_model,
+            data=inference_request.data,
+            prediction=predictions[start:end].item(),
+        )
+        for inference_request, start, end in zip(
+            inference_requests,
+            bounds[:-1],
+            bounds[1:],
+        )
+    ]
 
-    return inference_result
+    return inference_results
+
+
+def predict(inference_request: InferenceRequest) -> InferenceResult:
+    inference_model = select_model(inference_request)
+    return predict_batch(inference_model, [inference_request])[0]
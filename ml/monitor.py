@@ -83,7 +83,7 @@ class Monitoring:
         self.inferences = self.lh.ml_load_inferences(
             catalog="secure_stage",
             schema=self.schema,
-            table_name="inference_results",
+            table_name="inferences",
             since=self.since,
             until=self.until,
         )
@@ -0,0 +1,494 @@
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import threading
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+import mlflow
+from loguru import logger as log
+from mlflow import MlflowClient
+from mlflow.exceptions import MlflowException
+
+from ml.types import InferenceModel
+from shared.cache import (
+    LOCKS_DIR,
+    dir_size,
+    get_cache_dir,
+    record_hit,
+    record_miss,
+    record_write,
+    touch,
+)
+from shared.settings import env
+from shared.storage import file_checksum
+
+MODEL_REGISTRY_MAX_MB = env.int("MODEL_REGISTRY_MAX_MB", 2048)
+MODEL_REGISTRY_REFRESH_SECONDS = env.int("MODEL_REGISTRY_REFRESH_SECONDS", 300)
+
+# Comma-separated <name>/<version> entries (e.g., dd_logreg_tfidf/latest)
+MODEL_REGISTRY_WARMUP = env.list("MODEL_REGISTRY_WARMUP", [])
+MODEL_REGISTRY_PINNED = env.list("MODEL_REGISTRY_PINNED", [])
+
+MODEL_CACHE_META_FILE = "meta.json"
+
+
+class ModelNotFound(Exception):
+    pass
+
+
+# Artifact cache
+# ==============
+
+
+def model_cache_path(inference_model: InferenceModel) -> Path:
+    return (
+        get_cache_dir() / "ml/models" / inference_model.name / inference_model.version
+    )
+
+
+@contextmanager
+def _model_cache_lock(path: Path, shared: bool = False):
+    """
+    Hold a lock on a cached model version, across processes. Lock files live outside
+    the cache entries, so that evicting or expunging an entry never unlinks a lock
+    that another process holds.
+    """
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    cache_dir = get_cache_dir()
+    lock_path = cache_dir / LOCKS_DIR / path.relative_to(cache_dir)
+    lock_path = lock_path.with_name(f"{path.name}.lock")
+
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+
+    with open(lock_path, "w") as fp:
+        fcntl.flock(fp, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+
+        try:
+            yield
+        finally:
+            fcntl.flock(fp, fcntl.LOCK_UN)
+
+
+def _dir_checksum(path: Path) -> str:
+    sha256 = hashlib.sha256()
+
+    for file_path in sorted(p for p in path.rglob("*") if p.is_file()):
+        sha256.update(str(file_path.relative_to(path)).encode("utf-8"))
+        sha256.update(file_checksum(str(file_path)).encode("utf-8"))
+
+    return sha256.hexdigest()
+
+
+def _dir_file_stats(path: Path) -> dict[str, list[int]]:
+    """List the size and modification time of each file, to cheaply detect changes."""
+
+    return {
+        str(file_path.relative_to(path)): [
+            file_path.stat().st_size,
+            file_path.stat().st_mtime_ns,
+        ]
+        for file_path in sorted(p for p in path.rglob("*") if p.is_file())
+    }
+
+
+def _model_fingerprint(
+    inference_model: InferenceModel,
+    strict: bool = False,
+) -> str | None:
+    """
+    Identify the artifacts registered for a model version, returning None when the
+    registry can't be reached, unless strict.
+    """
+
+    try:
+        model_version = MlflowClient().get_model_version(
+            inference_model.name,
+            inference_model.version,
+        )
+    except MlflowException as e:
+        if e.error_code == "RESOURCE_DOES_NOT_EXIST":
+            raise ModelNotFound(
+                f"models:/{inference_model.name}/{inference_model.version}"
+            )
+
+        if strict:
+            raise
+
+        log.warning("Could not reach the model registry: {}", e)
+        return None
+
+    return f"{model_version.run_id}:{model_version.source}"
+
+
+def _read_model_cache_meta(path: Path) -> dict | None:
+    meta_path = path / MODEL_CACHE_META_FILE
+
+    if not meta_path.exists():
+        return None
+
+    try:
+        return json.loads(meta_path.read_text())
+    except json.JSONDecodeError:
+        return None
+
+
+def _download_model(inference_model: InferenceModel, path: Path, fingerprint: str):
+    model_uri = f"models:/{inference_model.name}/{inference_model.version}"
+    log.info("Downloading model artifacts: {}", model_uri)
+
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.{uuid.uuid4().hex}.tmp")
+
+    try:
+        local_path = mlflow.artifacts.download_artifacts(
+            artifact_uri=model_uri,
+            dst_path=str(tmp_path / "artifacts"),
+        )
+
+        model_dir = Path(local_path).resolve().relative_to(tmp_path.resolve())
+
+        meta = dict(
+            name=inference_model.name,
+            version=inference_model.version,
+            fingerprint=fingerprint,
+            model_dir=str(model_dir),
+            checksum=_dir_checksum(tmp_path / model_dir),
+            files=_dir_file_stats(tmp_path / model_dir),
+        )
+
+        (tmp_path / MODEL_CACHE_META_FILE).write_text(json.dumps(meta))
+
+        # Replaced artifacts are accounted for in the size ledger, as a single write
+        num_bytes = dir_size(tmp_path) - dir_size(path)
+
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+
+        record_write("ml", num_bytes)
+    finally:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+
+def _is_model_cache_valid(
+    path: Path,
+    meta: dict | None,
+    fingerprint: str | None,
+) -> bool:
+    if meta is None:
+        return False
+
+    if fingerprint is not None and meta["fingerprint"] != fingerprint:
+        log.info("Invalidating cached model artifacts: {}", path)
+        return False
+
+    # The checksum is computed once, on download, while hits only compare file stats
+    if _dir_file_stats(path / meta["model_dir"]) != meta.get("files"):
+        log.warning("Cached model artifacts were modified: {}", path)
+        return False
+
+    return True
+
+
+def fetch_model(inference_model: InferenceModel) -> Any:
+    """
+    Load a registered model version, using the on-disk artifact cache. Cached
+    artifacts are only downloaded again when the registry reports different
+    artifacts for the version, or when their files changed on disk.
+    """
+
+    path = model_cache_path(inference_model)
+    fingerprint = _model_fingerprint(inference_model)
+
+    # Readers share the lock, so that concurrent processes don't queue up on hits
+    with _model_cache_lock(path, shared=True):
+        meta = _read_model_cache_meta(path)
+
+        if _is_model_cache_valid(path, meta, fingerprint):
+            record_hit("ml")
+            touch(path)
+            return mlflow.sklearn.load_model(str(path / meta["model_dir"]))
+
+    with _model_cache_lock(path):
+        meta = _read_model_cache_meta(path)
+
+        # Another process might have downloaded the artifacts in the meantime
+        if _is_model_cache_valid(path, meta, fingerprint):
+            record_hit("ml")
+        else:
+            if fingerprint is None:
+                fingerprint = _model_fingerprint(inference_model, strict=True)
+
+            record_miss("ml")
+            _download_model(inference_model, path, fingerprint)
+            meta = _read_model_cache_meta(path)
+
+        return mlflow.sklearn.load_model(str(path / meta["model_dir"]))
+
+
+# Registry
+# ========
+
+
+def parse_model_uri(model_uri: str) -> InferenceModel:
+    name, version = model_uri.removeprefix("models:/").split("/")
+    return InferenceModel(name=name, version=version)
+
+
+def resolve_version(inference_model: InferenceModel) -> str:
+    """
+    Resolve the registered version number for a model version, which can also be
+    "latest" or an alias.
+    """
+
+    if inference_model.version.isdigit():
+        return inference_model.version
+
+    client = MlflowClient()
+
+    try:
+        if inference_model.version == "latest":
+            model_versions = client.search_model_versions(
+                f"name='{inference_model.name}'",
+                order_by=["version_number DESC"],
+                max_results=1,
+            )
+        else:
+            model_versions = [
+                client.get_model_version_by_alias(
+                    inference_model.name,
+                    inference_model.version,
+                )
+            ]
+    except MlflowException as e:
+        # Unknown aliases are reported as invalid parameters, not as missing resources
+        if e.error_code in ("RESOURCE_DOES_NOT_EXIST", "INVALID_PARAMETER_VALUE"):
+            raise ModelNotFound(
+                f"models:/{inference_model.name}/{inference_model.version}"
+            )
+
+        raise
+
+    if len(model_versions) == 0:
+        raise ModelNotFound(f"models:/{inference_model.name}/{inference_model.version}")
+
+    return str(model_versions[0].version)
+
+
+@dataclass
+class RegisteredModel:
+    model: Any
+    resolved_version: str
+    size: int
+
+
+class ModelRegistry:
+    """
+    Keep deserialized models in memory, evicting the least recently used ones once
+    max_mb is exceeded. Pinned models are never evicted, and models requested by
+    "latest" or by alias are reloaded in the background when a new version shows up.
+    """
+
+    def __init__(
+        self,
+        max_mb: int = MODEL_REGISTRY_MAX_MB,
+        refresh_seconds: int = MODEL_REGISTRY_REFRESH_SECONDS,
+    ):
+        self.max_bytes = max_mb * 1024**2
+        self.refresh_seconds = refresh_seconds
+
+        self.models: OrderedDict[tuple[str, str], RegisteredModel] = OrderedDict()
+        self.pinned: set[tuple[str, str]] = set()
+
+        self.lock = threading.Lock()
+        self.load_locks: dict[tuple[str, str], threading.Lock] = {}
+
+        self.refresh_thread: threading.Thread | None = None
+        self.refresh_stop = threading.Event()
+
+    @property
+    def size(self) -> int:
+        return sum(registered_model.size for registered_model in self.models.values())
+
+    def get(self, inference_model: InferenceModel) -> Any:
+        key = (inference_model.name, inference_model.version)
+
+        with self.lock:
+            if key in self.models:
+                self.models.move_to_end(key)
+                return self.models[key].model
+
+            load_lock = self.load_locks.setdefault(key, threading.Lock())
+
+        # Only one thread loads a given model, while others wait for it
+        with load_lock:
+            with self.lock:
+                if key in self.models:
+                    self.models.move_to_end(key)
+                    return self.models[key].model
+
+            registered_model = self._load(inference_model)
+
+            with self.lock:
+                self.models[key] = registered_model
+                self._evict()
+
+        return registered_model.model
+
+    def pin(self, inference_model: InferenceModel):
+        with self.lock:
+            self.pinned.add((inference_model.name, inference_model.version))
+
+        self.get(inference_model)
+
+    def unpin(self, inference_model: InferenceModel):
+        with self.lock:
+            self.pinned.discard((inference_model.name, inference_model.version))
+            self._evict()
+
+    def warmup(
+        self,
+        warmup_uris: list[str] = MODEL_REGISTRY_WARMUP,
+        pinned_uris: list[str] = MODEL_REGISTRY_PINNED,
+    ):
+        for model_uri in pinned_uris:
+            log.info("Pinning model: {}", model_uri)
+            self._try(self.pin, parse_model_uri(model_uri))
+
+        for model_uri in warmup_uris:
+            log.info("Warming up model: {}", model_uri)
+            self._try(self.get, parse_model_uri(model_uri))
+
+    def start(self):
+        if self.refresh_thread is not None or self.refresh_seconds <= 0:
+            return
+
+        self.refresh_stop.clear()
+        self.refresh_thread = threading.Thread(
+            target=self._refresh_loop,
+            name="model_registry_refresh",
+            daemon=True,
+        )
+        self.refresh_thread.start()
+
+    def stop(self):
+        if self.refresh_thread is None:
+            return
+
+        self.refresh_stop.set()
+        self.refresh_thread.join()
+        self.refresh_thread = None
+
+    def refresh(self):
+        """Reload models whose "latest" or aliased version now resolves differently."""
+
+        with self.lock:
+            keys = [key for key in self.models if not key[1].isdigit()]
+
+        for key in keys:
+            inference_model = InferenceModel(*key)
+
+            try:
+                resolved_version = resolve_version(inference_model)
+
+                with self.lock:
+                    registered_model = self.models.get(key)
+
+                if (
+                    registered_model is None
+                    or registered_model.resolved_version == resolved_version
+                ):
+                    continue
+
+                log.info(
+                    "Refreshing model {}/{}: version {} -> {}",
+                    *key,
+                    registered_model.resolved_version,
+                    resolved_version,
+                )
+
+                registered_model = self._load(inference_model, resolved_version)
+
+                with self.lock:
+                    if key in self.models:
+                        self.models[key] = registered_model
+                        self._evict()
+            except Exception as e:
+                log.error("Could not refresh model {}/{}: {}", *key, e)
+
+    def _refresh_loop(self):
+        while not self.refresh_stop.wait(self.refresh_seconds):
+            self.refresh()
+
+    def _load(
+        self,
+        inference_model: InferenceModel,
+        resolved_version: str | None = None,
+    ) -> RegisteredModel:
+        if resolved_version is None:
+            resolved_version = resolve_version(inference_model)
+
+        log.info("Loading model: models:/{}/{}", inference_model.name, resolved_version)
+
+        resolved_model = InferenceModel(inference_model.name, resolved_version)
+        model = fetch_model(resolved_model)
+
+        # Artifact size on disk approximates memory usage, without serializing again
+        size = dir_size(model_cache_path(resolved_model))
+
+        return RegisteredModel(
+            model=model,
+            resolved_version=resolved_version,
+            size=size,
+        )
+
+    def _evict(self):
+        # Must be called while holding self.lock
+        total_bytes = self.size
+
+        # The most recently used model is always kept, so it isn't reloaded every time
+        for key in list(self.models)[:-1]:
+            if total_bytes <= self.max_bytes:
+                break
+
+            if key in self.pinned:
+                continue
+
+            log.info("Evicting model from memory: {}/{}", *key)
+
+            total_bytes -= self.models.pop(key).size
+
+        if total_bytes > self.max_bytes:
+            log.warning(
+                "Model registry is using {} MiB, over its {} MiB budget",
+                total_bytes // 1024**2,
+                self.max_bytes // 1024**2,
+            )
+
+    def _try(self, fn, inference_model: InferenceModel):
+        try:
+            fn(inference_model)
+        except Exception as e:
+            log.error(
+                "Could not load model {}/{}: {}",
+                inference_model.name,
+                inference_model.version,
+                e,
+            )
+
+
+model_registry = ModelRegistry()
+
+
+def init_model_registry():
+    """Warm up the process-wide registry and start refreshing it in the background."""
+
+    model_registry.warmup()
+    model_registry.start()
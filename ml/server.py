@@ -7,6 +7,7 @@ from fastapi import FastAPI, Request, Response, status
 from fastapi.responses import JSONResponse
 from loguru import logger as log
 
+from ml.batching import InferenceBatcher, InferenceQueueFull
 from ml.events import (
     flush_inference_feedback_queue,
     flush_inference_result_queue,
@@ -15,9 +16,16 @@ from ml.events import (
     make_inference_producer,
     queue_inference_feedback,
     queue_inference_result,
+    queue_inference_results,
+)
+from ml.inference import ModelNotFound
+from ml.types import (
+    BatchInferenceRequest,
+    InferenceFeedback,
+    InferenceProducerType,
+    InferenceRequest,
+    InvalidInferenceRequest,
 )
-from ml.inference import ModelNotFound, predict
-from ml.types import InferenceFeedback, InferenceProducerType, InferenceRequest
 
 SERVER_NAME = "datalab-mlserver"
 DEFAULT_HOST = "0.0.0.0"
@@ -73,6 +81,12 @@ async def lifespan(app: FastAPI):
             )
         )
 
+    log.info("Warming up model registry")
+
+    inference_batcher = InferenceBatcher()
+    await inference_batcher.start()
+
+    app.state.inference_batcher = inference_batcher
     app.state.inference_result_producer = inference_result_producer
     app.state.inference_feedback_producer = inference_feedback_producer
 
@@ -91,6 +105,8 @@ async def lifespan(app: FastAPI):
     await inference_result_producer.stop()
     await inference_feedback_producer.stop()
 
+    inference_batcher.close()
+
 
 app = FastAPI(
     lifespan=lifespan,
@@ -125,12 +141,25 @@ async def inference_logs_flush():
 @app.post("/inference")
 async def inference(inference_request: InferenceRequest, request: Request):
     try:
-        inference_result = predict(inference_request)
+        inference_result = await request.app.state.inference_batcher.predict(
+            inference_request
+        )
     except ModelNotFound:
         return JSONResponse(
             {"error": "Model not found"},
             status_code=status.HTTP_404_NOT_FOUND,
         )
+    except InvalidInferenceRequest as e:
+        return JSONResponse(
+            {"error": str(e)},
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+        )
+    except InferenceQueueFull as e:
+        return JSONResponse(
+            {"error": "Too many requests", "retry_after": e.retry_after},
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            headers={"Retry-After": str(e.retry_after)},
+        )
 
     if inference_request.log_to_lakehouse:
         log.info("Queuing lakehouse insertion for inference result")
@@ -145,6 +174,73 @@ async def inference(inference_request: InferenceRequest, request: Request):
     return inference_result
 
 
+@app.post("/inference/batch")
+async def inference_batch(
+    batch_inference_request: BatchInferenceRequest,
+    request: Request,
+):
+    try:
+        inference_results = await request.app.state.inference_batcher.predict_many(
+            batch_inference_request.get_requests()
+        )
+    except InvalidInferenceRequest as e:
+        return JSONResponse(
+            {"error": str(e)},
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+        )
+    except InferenceQueueFull as e:
+        return JSONResponse(
+            {"error": "Too many requests", "retry_after": e.retry_after},
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            headers={"Retry-After": str(e.retry_after)},
+        )
+
+    errors = [r for r in inference_results if isinstance(r, Exception)]
+
+    if len(errors) == len(inference_results) > 0 and all(
+        isinstance(e, ModelNotFound) for e in errors
+    ):
+        return JSONResponse(
+            {"error": "Model not found"},
+            status_code=status.HTTP_404_NOT_FOUND,
+        )
+
+    for e in errors:
+        if not isinstance(e, ModelNotFound):
+            log.error("Inference failed for batch item: {}", e)
+
+    succeeded = [r for r in inference_results if not isinstance(r, Exception)]
+
+    if batch_inference_request.log_to_lakehouse and len(succeeded) > 0:
+        log.info(
+            "Queuing lakehouse insertion for {} inference results",
+            len(succeeded),
+        )
+
+        asyncio.create_task(
+            queue_inference_results(
+                request.app.state.inference_result_producer,
+                succeeded,
+            )
+        )
+
+    # Failed items are reported in place, without failing the whole batch
+    return [
+        (
+            {
+                "error": (
+                    "Model not found"
+                    if isinstance(r, ModelNotFound)
+                    else "Inference failed"
+                )
+            }
+            if isinstance(r, Exception)
+            else r
+        )
+        for r in inference_results
+    ]
+
+
 @app.patch("/inference")
 async def inference(inference_feedback: InferenceFeedback, request: Request):
     log.info("Queuing lakehouse append for inference feedback")
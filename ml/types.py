@@ -1,14 +1,19 @@
 from dataclasses import dataclass, fields
 from datetime import datetime, timezone
 from enum import Enum
-from typing import Sequence
 
 import pandas as pd
 
-InferenceInput = str | Sequence[float]
+# A single input row, so that each request maps to exactly one result (lists are
+# rejected, use /inference/batch items for multiple inputs)
+InferenceInput = str | float
 InferenceOutput = float
 
 
+class InvalidInferenceRequest(Exception):
+    pass
+
+
 class InferenceProducerType(Enum):
     RESULT = 1
     FEEDBACK = 2
@@ -26,9 +31,38 @@ class InferenceRequest:
     data: InferenceInput
     log_to_lakehouse: bool = True
 
+    def validate(self):
+        if isinstance(self.data, str) and len(self.data.strip()) == 0:
+            raise InvalidInferenceRequest("Inference data must not be empty")
+
     def get_input(self) -> pd.DataFrame:
-        data = [self.data] if type(self.data) is str else self.data
-        return pd.Series(data, name="input").to_frame()
+        self.validate()
+        return pd.Series([self.data], name="input").to_frame()
+
+
+@dataclass
+class BatchInferenceItem:
+    data: InferenceInput
+    models: list[InferenceModel] | InferenceModel | None = None
+
+
+@dataclass
+class BatchInferenceRequest:
+    models: list[InferenceModel] | InferenceModel
+    items: list[BatchInferenceItem]
+    log_to_lakehouse: bool = True
+
+    def get_requests(self) -> list[InferenceRequest]:
+        """Split into one request per item, routed to the item models, if set."""
+
+        return [
+            InferenceRequest(
+                models=self.models if item.models is None else item.models,
+                data=item.data,
+                log_to_lakehouse=self.log_to_lakehouse,
+            )
+            for item in self.items
+        ]
 
 
 @dataclass
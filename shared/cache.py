@@ -1,4 +1,12 @@
+import fcntl
+import json
+import os
 import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import timedelta
 from pathlib import Path
 from typing import Optional
 
@@ -7,6 +15,37 @@ from loguru import logger as log
 from platformdirs import user_cache_dir
 from requests_cache.session import CachedSession
 
+from shared.settings import env
+
+STATS_FILE = ".stats.json"
+STATS_LOCK_FILE = ".stats.lock"
+
+# Lock files are kept apart from namespaces, which only hold evictable entries
+LOCKS_DIR = ".locks"
+
+DEFAULT_CACHE_QUOTAS_MB = {"datacite": 10240, "lakehouse": 10240}
+CACHE_QUOTAS_MB = DEFAULT_CACHE_QUOTAS_MB | env.dict(
+    "CACHE_QUOTAS_MB",
+    subcast_values=int,
+    default={},
+)
+
+# Depth, relative to the namespace directory, of the entries that are evicted as a
+# whole (e.g., a Hugging Face clone lives under huggingface/<author>/<slug>)
+CACHE_ENTRY_DEPTH = {
+    "huggingface": 2,
+    "datacite": 2,
+    "lakehouse": 2,
+    "ml": 3,
+}
+
+# The size ledger is updated on every recorded write/eviction, and reconciled by
+# scanning the filesystem once it's older than this
+CACHE_LEDGER_TTL_HOURS = env.int("CACHE_LEDGER_TTL_HOURS", 24)
+CACHE_SCAN_MAX_WORKERS = env.int("CACHE_SCAN_MAX_WORKERS", 16)
+
+_stats_lock = threading.Lock()
+
 
 def get_cache_dir() -> Path:
     cache_dir = Path(user_cache_dir("datalab"))
@@ -14,12 +53,266 @@ def get_cache_dir() -> Path:
     return cache_dir
 
 
-def get_requests_cache_session(name: str) -> CachedSession:
+def get_requests_cache_session(
+    name: str,
+    expire_after: Optional[timedelta] = None,
+) -> CachedSession:
     cache_dir = get_cache_dir() / "requests" / name
-    session = CachedSession(cache_name=cache_dir, backend="filesystem")
+
+    session = CachedSession(
+        cache_name=cache_dir,
+        backend="filesystem",
+        expire_after=-1 if expire_after is None else expire_after,
+    )
+
+    def record_response(response, *args, **kwargs):
+        if getattr(response, "from_cache", False):
+            record_hit("requests")
+        else:
+            record_miss("requests")
+
+    session.hooks["response"].append(record_response)
+
+    if cache_dir.exists():
+        touch(cache_dir)
+
+    enforce_quota("requests")
+
     return session
 
 
+# Statistics
+# ==========
+
+
+def load_stats() -> dict[str, dict[str, int]]:
+    stats_path = get_cache_dir() / STATS_FILE
+
+    if not stats_path.exists():
+        return {}
+
+    try:
+        return json.loads(stats_path.read_text())
+    except json.JSONDecodeError:
+        log.warning("Resetting corrupted cache statistics: {}", stats_path)
+        return {}
+
+
+def _save_stats(stats: dict[str, dict[str, int]]):
+    stats_path = get_cache_dir() / STATS_FILE
+    tmp_stats_path = stats_path.with_suffix(f".{os.getpid()}.tmp")
+    tmp_stats_path.write_text(json.dumps(stats))
+    os.replace(tmp_stats_path, stats_path)
+
+
+@contextmanager
+def _locked_stats():
+    """Hold an exclusive lock on the statistics file, across threads and processes."""
+
+    with _stats_lock, open(get_cache_dir() / STATS_LOCK_FILE, "w") as fp:
+        fcntl.flock(fp, fcntl.LOCK_EX)
+
+        try:
+            yield
+        finally:
+            fcntl.flock(fp, fcntl.LOCK_UN)
+
+
+def _record(namespace: str, **increments: int):
+    with _locked_stats():
+        stats = load_stats()
+        ns_stats = stats.setdefault(namespace, {})
+
+        for name, value in increments.items():
+            ns_stats[name] = ns_stats.get(name, 0) + value
+
+        _save_stats(stats)
+
+
+def record_hit(namespace: str):
+    _record(namespace, hits=1)
+
+
+def record_miss(namespace: str):
+    _record(namespace, misses=1)
+
+
+def record_write(namespace: str, num_bytes: int):
+    """Update the size ledger for a namespace after writing (or deleting) bytes."""
+    _record(namespace, bytes=num_bytes)
+
+
+def _invalidate_ledger(namespace: Optional[str] = None):
+    with _locked_stats():
+        stats = load_stats()
+
+        for ns, ns_stats in stats.items():
+            if namespace is None or ns == namespace:
+                ns_stats.pop("reconciled_at", None)
+
+        _save_stats(stats)
+
+
+def _ledger_is_stale(ns_stats: dict[str, int]) -> bool:
+    if "reconciled_at" not in ns_stats:
+        return True
+
+    age = time.time() - ns_stats["reconciled_at"]
+
+    return age > CACHE_LEDGER_TTL_HOURS * 3600
+
+
+def reconcile(namespace: str) -> int:
+    """Rescan a namespace directory and reset its size ledger."""
+
+    log.info("Reconciling cache size ledger for {}", namespace)
+
+    num_bytes = parallel_dir_size(get_cache_dir() / namespace)
+
+    with _locked_stats():
+        stats = load_stats()
+        ns_stats = stats.setdefault(namespace, {})
+        ns_stats["bytes"] = num_bytes
+        ns_stats["reconciled_at"] = int(time.time())
+        _save_stats(stats)
+
+    return num_bytes
+
+
+def namespace_size(namespace: str) -> int:
+    ns_stats = load_stats().get(namespace, {})
+
+    if _ledger_is_stale(ns_stats):
+        return reconcile(namespace)
+
+    return ns_stats.get("bytes", 0)
+
+
+# Eviction
+# ========
+
+
+def touch(path: Path):
+    """Mark a cache entry as recently used, for LRU eviction."""
+    os.utime(path)
+
+
+def dir_size(path: Path) -> int:
+    total_bytes = 0
+
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    total_bytes += dir_size(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    total_bytes += entry.stat(follow_symlinks=False).st_size
+    except FileNotFoundError:
+        pass
+
+    return total_bytes
+
+
+def parallel_dir_size(path: Path) -> int:
+    """Compute the size of a directory, scanning its subdirectories in parallel."""
+
+    total_bytes = 0
+    subdirs = []
+
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    total_bytes += entry.stat(follow_symlinks=False).st_size
+    except FileNotFoundError:
+        return 0
+
+    with ThreadPoolExecutor(max_workers=CACHE_SCAN_MAX_WORKERS) as executor:
+        total_bytes += sum(executor.map(dir_size, subdirs))
+
+    return total_bytes
+
+
+def cache_entries(namespace: str) -> list[tuple[float, int, Path]]:
+    """List (last_used, size, path) for all evictable entries within a namespace."""
+
+    ns_dir = get_cache_dir() / namespace
+
+    if not ns_dir.exists():
+        return []
+
+    depth = CACHE_ENTRY_DEPTH.get(namespace, 1)
+    entry_paths = [ns_dir]
+
+    for _ in range(depth):
+        # Hidden entries are still being written (e.g., temporary download dirs)
+        entry_paths = [
+            child
+            for entry_path in entry_paths
+            if entry_path.is_dir()
+            for child in entry_path.iterdir()
+            if not child.name.startswith(".")
+        ]
+
+    entries = []
+
+    for entry_path in entry_paths:
+        stat = entry_path.stat()
+        last_used = max(stat.st_atime, stat.st_mtime)
+        size = dir_size(entry_path) if entry_path.is_dir() else stat.st_size
+        entries.append((last_used, size, entry_path))
+
+    return entries
+
+
+def enforce_quota(namespace: str) -> int:
+    """Evict least recently used entries until the namespace fits within its quota."""
+
+    if namespace not in CACHE_QUOTAS_MB:
+        return 0
+
+    max_bytes = CACHE_QUOTAS_MB[namespace] * 1024**2
+
+    if namespace_size(namespace) <= max_bytes:
+        return 0
+
+    entries = cache_entries(namespace)
+    total_bytes = sum(size for _, size, _ in entries)
+
+    evicted_bytes = 0
+    evicted_count = 0
+
+    for _, size, entry_path in sorted(entries):
+        if total_bytes - evicted_bytes <= max_bytes:
+            break
+
+        log.info("Evicting from {} cache: {}", namespace, entry_path)
+
+        if entry_path.is_dir():
+            shutil.rmtree(entry_path, ignore_errors=True)
+        else:
+            entry_path.unlink(missing_ok=True)
+
+        evicted_bytes += size
+        evicted_count += 1
+
+    if evicted_count > 0:
+        _record(
+            namespace,
+            evictions=evicted_count,
+            evicted_bytes=evicted_bytes,
+            bytes=-evicted_bytes,
+        )
+
+    return evicted_bytes
+
+
+# Management
+# ==========
+
+
 def expunge_cache(namespace: Optional[str] = None, name: Optional[str] = None):
     cache_dir = get_cache_dir()
 
@@ -30,35 +323,54 @@ def expunge_cache(namespace: Optional[str] = None, name: Optional[str] = None):
         case (_, None):
             log.info("Cleaning cache for {}", namespace)
             shutil.rmtree(cache_dir / namespace)
+            _invalidate_ledger(namespace)
         case (None, _):
             raise ValueError("name requires namespace to be set")
         case _:
             log.info("Cleaning cache for {}: {}", namespace, name)
             shutil.rmtree(cache_dir / namespace / name)
+            _invalidate_ledger(namespace)
 
 
-def cache_usage():
+def cache_usage(force_reconcile: bool = False):
     log.info("Calculating cache usage statistics")
 
     cache_dir = get_cache_dir()
 
+    if force_reconcile:
+        _invalidate_ledger()
+
     total_size_bytes = 0
     byte_size_per_dir = {}
 
     for path in cache_dir.iterdir():
+        if path.name == LOCKS_DIR:
+            continue
+
         if path.is_dir():
             dir_name = f"{path.relative_to(cache_dir)}/"
-
-            byte_size_per_dir[dir_name] = sum(
-                f.stat().st_size for f in path.rglob("*") if f.is_file()
-            )
-
+            byte_size_per_dir[dir_name] = namespace_size(path.name)
             total_size_bytes += byte_size_per_dir[dir_name]
 
         elif path.is_file():
             total_size_bytes += path.stat().st_size
 
+    stats = load_stats()
+
     print("Total:", humanize.naturalsize(total_size_bytes))
 
-    for dir_name, dir_size in byte_size_per_dir.items():
-        print(f"\t{dir_name}", humanize.naturalsize(dir_size))
+    for dir_name, dir_size_bytes in byte_size_per_dir.items():
+        namespace = dir_name.rstrip("/")
+        ns_stats = stats.get(namespace, {})
+
+        quota = CACHE_QUOTAS_MB.get(namespace)
+        quota = "unbounded" if quota is None else humanize.naturalsize(quota * 1024**2)
+
+        print(
+            f"\t{dir_name}",
+            humanize.naturalsize(dir_size_bytes),
+            f"(quota: {quota},",
+            f"hits: {ns_stats.get('hits', 0)},",
+            f"misses: {ns_stats.get('misses', 0)},",
+            f"evictions: {ns_stats.get('evictions', 0)})",
+        )
@@ -1,49 +1,410 @@
+import hashlib
 import json
 import os
-from datetime import datetime
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
 from pathlib import Path
-from typing import Literal, Optional
+from typing import Any, Callable, Iterator, Literal, Optional
 
 import duckdb
+import humanize
 import pandas as pd
 from duckdb import ColumnExpression
 from loguru import logger as log
 
 from ml.types import InferenceFeedback, InferenceResult
+from shared.cache import (
+    enforce_quota,
+    get_cache_dir,
+    record_hit,
+    record_miss,
+    record_write,
+    touch,
+)
 from shared.settings import LOCAL_DIR, env
 from shared.storage import Storage, StoragePrefix
-from shared.tools import generate_init_sql
+from shared.tools import generate_attach_sql, generate_init_sql
+
+EXPORT_MAX_WORKERS = env.int("EXPORT_MAX_WORKERS", 4)
+EXPORT_ROW_GROUP_SIZE = env.int("EXPORT_ROW_GROUP_SIZE", 122_880)
+EXPORT_COMPRESSION = env.str("EXPORT_COMPRESSION", "zstd")
+EXPORT_PER_THREAD_OUTPUT = env.bool("EXPORT_PER_THREAD_OUTPUT", False)
+EXPORT_FILE_SIZE_MB = env.int("EXPORT_FILE_SIZE_MB", 0)
+EXPORT_SORTED = env.bool("EXPORT_SORTED", True)
+
+# Tables are sorted by the first key whose columns they all contain (e.g., graph
+# edges by source node), so that parquet row group statistics can be used to skip data
+EXPORT_SORT_KEYS = (
+    ("source_id", "target_id"),
+    ("node_id",),
+)
+
+ML_BATCH_SIZE = env.int("ML_BATCH_SIZE", 100_000)
+ML_CACHE = env.bool("ML_CACHE", True)
+
+# Query results from these catalogs are never cached locally, as they are sensitive
+ML_CACHE_EXCLUDED_CATALOGS = ("secure_stage",)
+
+
+_lakehouse_lock = threading.Lock()
+_lakehouse_conns: dict[tuple[str, bool], duckdb.DuckDBPyConnection] = {}
+_lakehouse_attached: dict[tuple[str, bool], set[str]] = {}
+_lakehouse_ml_inference_schemas: dict[tuple[str, bool], set[str]] = {}
 
 
 class LakehouseException(Exception):
     pass
 
 
-class Lakehouse:
-    def __init__(self, in_memory: bool = False, read_only: bool = True):
+@dataclass
+class TableExport:
+    table_fqn: str
+    path: str
+    snapshot_id: Optional[int] = None
+    reused: bool = False
+    rows: int = 0
+    bytes: int = 0
+    seconds: float = 0.0
+    files: dict[str, dict[str, int]] = field(default_factory=dict)
+    error: Optional[str] = None
+
+    @property
+    def name(self) -> str:
+        return self.table_fqn.split(".")[-1]
+
+
+@dataclass
+class ExportReport:
+    path: str
+    snapshot_id: Optional[int] = None
+    tables: list[TableExport] = field(default_factory=list)
+
+    @property
+    def failed(self) -> list[TableExport]:
+        return [table for table in self.tables if table.error is not None]
+
+    @property
+    def rows(self) -> int:
+        return sum(table.rows for table in self.tables)
+
+    @property
+    def bytes(self) -> int:
+        return sum(table.bytes for table in self.tables)
+
+    @property
+    def files(self) -> dict[str, dict[str, int]]:
+        return {
+            rel_path: file_stats
+            for table in self.tables
+            for rel_path, file_stats in table.files.items()
+        }
+
+    @property
+    def table_versions(self) -> dict[str, dict[str, Any]]:
+        return {
+            table.name: dict(snapshot_id=table.snapshot_id, files=list(table.files))
+            for table in self.tables
+        }
+
+
+def get_lakehouse_connection(
+    in_memory: bool = False,
+    read_only: bool = True,
+) -> duckdb.DuckDBPyConnection:
+    """
+    Return the process-wide DuckDB connection for the engine database, or for an
+    in-memory database, running the init SQL only once, when first connecting.
+
+    Catalogs are not attached here, but on first use, via Lakehouse.attach.
+    """
+
+    key = _lakehouse_key(in_memory, read_only)
+
+    with _lakehouse_lock:
+        if key in _lakehouse_conns:
+            return _lakehouse_conns[key]
+
+        database, read_only = key
+
         if in_memory:
             log.info("Connecting to DuckDB: in-memory")
-            self.conn = duckdb.connect()
+            conn = duckdb.connect()
         else:
-            engine_db = os.path.join(LOCAL_DIR, env.str("ENGINE_DB"))
-            log.info("Connecting to DuckDB: {}", engine_db)
-            self.conn = duckdb.connect(engine_db, read_only=read_only)
+            log.info("Connecting to DuckDB: {}", database)
+            conn = duckdb.connect(database, read_only=read_only)
 
         log.info("Initializing lakehouse with init SQL")
 
         try:
-            init_sql = generate_init_sql()
-            self.conn.execute(init_sql)
+            init_sql = generate_init_sql(attach=False)
+            conn.execute(init_sql)
         except Exception as e:
+            conn.close()
             raise LakehouseException(f"Error executing init SQL: {e}")
 
+        _lakehouse_conns[key] = conn
+        _lakehouse_attached[key] = set()
+        _lakehouse_ml_inference_schemas[key] = set()
+
+        return conn
+
+
+def _lakehouse_key(in_memory: bool, read_only: bool) -> tuple[str, bool]:
+    if in_memory:
+        return (":memory:", False)
+
+    return (os.path.join(LOCAL_DIR, env.str("ENGINE_DB")), read_only)
+
+
+class Lakehouse:
+    def __init__(
+        self,
+        in_memory: bool = False,
+        read_only: bool = True,
+        catalogs: Optional[list[str]] = None,
+    ):
+        self._key = _lakehouse_key(in_memory, read_only)
+        self._root_conn = get_lakehouse_connection(in_memory, read_only)
+        self._local = threading.local()
+
         self.storage = Storage(prefix=StoragePrefix.EXPORTS)
 
+        if catalogs is not None:
+            self.attach(*catalogs)
+
+    @property
+    def conn(self) -> duckdb.DuckDBPyConnection:
+        """
+        Cursor for the current thread. Cursors share the same database instance,
+        along with its secrets and attached catalogs, but queries can run in parallel.
+        """
+
+        if not hasattr(self._local, "cursor"):
+            self._local.cursor = self._root_conn.cursor()
+
+        return self._local.cursor
+
+    def attach(self, *catalogs: str):
+        """
+        Attach DuckLake catalogs that are not yet attached to the shared connection.
+        Unknown catalogs are ignored, as they might not be DuckLake catalogs.
+        """
+
+        with _lakehouse_lock:
+            attached = _lakehouse_attached[self._key]
+            pending = [catalog for catalog in catalogs if catalog not in attached]
+
+            if len(pending) == 0:
+                return
+
+            attachments_sql = generate_attach_sql()
+
+            for catalog in pending:
+                if catalog in attachments_sql:
+                    log.info("Attaching {} catalog", catalog)
+
+                    try:
+                        self._root_conn.execute(attachments_sql[catalog])
+                    except Exception as e:
+                        raise LakehouseException(f"Error attaching {catalog}: {e}")
+
+                attached.add(catalog)
+
     # Exporting
     # =========
 
-    def export(self, catalog: str, schema: str) -> str:
-        s3_export_path = self.storage.get_dir(f"{catalog}/{schema}", dated=True)
+    def _export_path(self, s3_export_path: str, name: str) -> str:
+        # Multiple files per table are written to a directory named after the table
+        is_dir = EXPORT_PER_THREAD_OUTPUT or EXPORT_FILE_SIZE_MB > 0
+        suffix = "" if is_dir else ".parquet"
+
+        if "nodes" in name:
+            return f"{s3_export_path}/nodes/{name}{suffix}"
+
+        if "edges" in name:
+            return f"{s3_export_path}/edges/{name}{suffix}"
+
+        return f"{s3_export_path}/{name}{suffix}"
+
+    def _export_sort_keys(
+        self,
+        catalog: str,
+        schema: str,
+    ) -> dict[str, tuple[str, ...]]:
+        self.conn.execute(
+            """
+            SELECT
+                table_name,
+                list(column_name)
+            FROM
+                information_schema.columns
+            WHERE
+                table_catalog = ?
+                AND table_schema = ?
+            GROUP BY
+                table_name
+            """,
+            (catalog, schema),
+        )
+
+        sort_keys = {}
+
+        for name, columns in self.conn.fetchall():
+            for sort_key in EXPORT_SORT_KEYS:
+                if all(column in columns for column in sort_key):
+                    sort_keys[name] = sort_key
+                    break
+
+        return sort_keys
+
+    def _export_table(
+        self,
+        s3_export_path: str,
+        table_fqn: str,
+        path: str,
+        sort_key: tuple[str, ...] = (),
+    ) -> TableExport:
+        table_export = TableExport(table_fqn=table_fqn, path=path)
+
+        options = [
+            "FORMAT parquet",
+            f"ROW_GROUP_SIZE {EXPORT_ROW_GROUP_SIZE}",
+            f"COMPRESSION {EXPORT_COMPRESSION}",
+            "RETURN_STATS",
+        ]
+
+        if EXPORT_PER_THREAD_OUTPUT:
+            options.append("PER_THREAD_OUTPUT")
+
+        if EXPORT_FILE_SIZE_MB > 0:
+            options.append(f"FILE_SIZE_BYTES '{EXPORT_FILE_SIZE_MB}MB'")
+
+        if len(sort_key) > 0:
+            source = f"(SELECT * FROM {table_fqn} ORDER BY {', '.join(sort_key)})"
+            log.info("Exporting {} to {}, sorted by {}", table_fqn, path, sort_key)
+        else:
+            source = table_fqn
+            log.info("Exporting {} to {}", table_fqn, path)
+
+        start = time.perf_counter()
+
+        try:
+            self.conn.execute(f"COPY {source} TO '{path}' ({', '.join(options)})")
+            file_stats = self.conn.fetchall()
+        except Exception as e:
+            table_export.error = str(e)
+            log.error("Could not export {}: {}", table_fqn, e)
+            return table_export
+
+        table_export.seconds = time.perf_counter() - start
+
+        for filename, rows, size, *_ in file_stats:
+            rel_path = filename.removeprefix(f"{s3_export_path}/")
+            table_export.files[rel_path] = dict(rows=rows, size=size)
+            table_export.rows += rows
+            table_export.bytes += size
+
+        log.info(
+            "Exported {}: {} rows, {} in {:.2f}s",
+            table_fqn,
+            table_export.rows,
+            humanize.naturalsize(table_export.bytes),
+            table_export.seconds,
+        )
+
+        return table_export
+
+    def _reuse_table(
+        self,
+        s3_export_path: str,
+        table_fqn: str,
+        path: str,
+        previous_manifest: dict[str, Any],
+    ) -> TableExport:
+        table_export = TableExport(table_fqn=table_fqn, path=path, reused=True)
+        previous_files = previous_manifest.get("files", {})
+
+        log.info("Reusing unchanged {} from {}", table_fqn, previous_manifest["latest"])
+
+        start = time.perf_counter()
+
+        try:
+            for rel_path in previous_manifest["tables"][table_export.name]["files"]:
+                self.storage.copy(
+                    f"{previous_manifest['latest']}/{rel_path}",
+                    f"{s3_export_path}/{rel_path}",
+                )
+
+                file_stats = previous_files.get(rel_path, dict(rows=0, size=0))
+                table_export.files[rel_path] = file_stats
+                table_export.rows += file_stats["rows"]
+                table_export.bytes += file_stats["size"]
+        except Exception as e:
+            table_export.error = str(e)
+            log.error("Could not reuse {}: {}", table_fqn, e)
+            return table_export
+
+        table_export.seconds = time.perf_counter() - start
+
+        return table_export
+
+    def export(
+        self,
+        catalog: str,
+        schema: str,
+        incremental: bool = False,
+    ) -> ExportReport:
+        """
+        Export all tables in a catalog schema to a new dated directory.
+
+        When incremental, only tables changed since the previous export, according to
+        their DuckLake snapshot ids, are rewritten, while unchanged files are copied,
+        server-side, from the previous export. If nothing changed, the previous export
+        is kept as is.
+        """
+
+        self.attach(catalog)
+
+        ds_name = f"{catalog}/{schema}"
+        snapshot_id = self.snapshot_id(catalog)
+        table_snapshot_ids = self.table_snapshot_ids(catalog, schema)
+
+        previous_manifest = self.storage.load_manifest(ds_name) if incremental else None
+
+        if previous_manifest is not None and "tables" not in previous_manifest:
+            log.warning("Previous export has no table versions, exporting everything")
+            previous_manifest = None
+
+        previous_tables = (
+            {} if previous_manifest is None else previous_manifest["tables"]
+        )
+
+        unchanged = {
+            name
+            for name, table_snapshot_id in table_snapshot_ids.items()
+            if name in previous_tables
+            and previous_tables[name]["snapshot_id"] == table_snapshot_id
+        }
+
+        is_unchanged = unchanged == set(previous_tables) == set(table_snapshot_ids)
+
+        if previous_manifest is not None and is_unchanged:
+            log.info(
+                "No changes to {}.{} since {}, skipping export",
+                catalog,
+                schema,
+                previous_manifest["latest"],
+            )
+
+            return ExportReport(
+                path=previous_manifest["latest"],
+                snapshot_id=previous_manifest.get("snapshot_id"),
+            )
+
+        s3_export_path = self.storage.get_dir(ds_name, dated=True)
 
         log.info("Exporting {}.{} to {}", catalog, schema, s3_export_path)
 
@@ -71,28 +432,87 @@ class Lakehouse:
             schema,
         )
 
-        for database, _, name in tables:
-            if "nodes" in name:
-                path = f"{s3_export_path}/nodes/{name}.parquet"
-            elif "edges" in name:
-                path = f"{s3_export_path}/edges/{name}.parquet"
-            else:
-                path = f"{s3_export_path}/{name}.parquet"
+        sort_keys = self._export_sort_keys(catalog, schema) if EXPORT_SORTED else {}
 
-            table_fqn = f"{database}.{schema}.{name}"
+        if previous_manifest is not None:
+            log.info(
+                "Reusing {} unchanged tables from {}",
+                len(unchanged),
+                previous_manifest["latest"],
+            )
 
-            try:
-                log.info("Exporting {} to {}", table_fqn, path)
-                self.conn.execute(f"COPY {table_fqn} TO '{path}' (FORMAT parquet)")
-            except:
-                log.error(f"Could not export {table_fqn}: COPY failed")
-                break
+        report = ExportReport(path=s3_export_path, snapshot_id=snapshot_id)
+        start = time.perf_counter()
+
+        with ThreadPoolExecutor(max_workers=EXPORT_MAX_WORKERS) as executor:
+            futures = {}
+
+            for database, _, name in tables:
+                table_fqn = f"{database}.{schema}.{name}"
+                path = self._export_path(s3_export_path, name)
+
+                if name in unchanged:
+                    future = executor.submit(
+                        self._reuse_table,
+                        s3_export_path,
+                        table_fqn,
+                        path,
+                        previous_manifest,
+                    )
+                else:
+                    future = executor.submit(
+                        self._export_table,
+                        s3_export_path,
+                        table_fqn,
+                        path,
+                        sort_keys.get(name, ()),
+                    )
+
+                futures[future] = name
+
+            for future in as_completed(futures):
+                table_export = future.result()
+                table_export.snapshot_id = table_snapshot_ids.get(futures[future])
+                report.tables.append(table_export)
+
+        report.tables.sort(key=lambda table: table.table_fqn)
+        elapsed = time.perf_counter() - start
+
+        for table in report.tables:
+            log.info(
+                "{}: {}",
+                table.table_fqn,
+                (
+                    f"FAILED ({table.error})"
+                    if table.error is not None
+                    else f"{table.rows} rows, {humanize.naturalsize(table.bytes)}, "
+                    f"{table.seconds:.2f}s{' (reused)' if table.reused else ''}"
+                ),
+            )
 
-        self.storage.upload_manifest(f"{catalog}/{schema}", latest=s3_export_path)
+        if len(report.failed) > 0:
+            raise LakehouseException(
+                f"Could not export {len(report.failed)} of {len(report.tables)} "
+                f"tables from {catalog}.{schema}, keeping the previous latest export"
+            )
 
-        log.info("Export completed: {}", s3_export_path)
+        self.storage.upload_manifest(
+            ds_name,
+            latest=s3_export_path,
+            files=report.files,
+            snapshot_id=report.snapshot_id,
+            tables=report.table_versions,
+        )
 
-        return s3_export_path
+        log.info(
+            "Export completed: {} ({} rows, {} in {:.2f}s)",
+            s3_export_path,
+            report.rows,
+            humanize.naturalsize(report.bytes),
+            elapsed,
+        )
+
+        return report
 
     def latest_export(self, catalog: str, schema: str) -> Optional[str]:
         manifest = self.storage.load_manifest(f"{catalog}/{schema}")
@@ -111,6 +531,7 @@ class Lakehouse:
 
     def copy_into(self, catalog: str, schema: str, table_name: str, from_path: str):
         log.info("Loading into {}.{}.{}: {}", catalog, schema, table_name, from_path)
+        self.attach(catalog)
 
         suffix = Path(from_path).suffix.lstrip(".")
 
@@ -131,6 +552,7 @@ class Lakehouse:
 
     def snapshot_id(self, catalog: str) -> int:
         log.info("Querying snapshot_id (version) for {} catalog", catalog)
+        self.attach(catalog)
 
         rel = self.conn.sql(
             f"""--sql
@@ -143,6 +565,116 @@ class Lakehouse:
 
         return snapshot_id
 
+    def _catalog_identity(self, catalog: str) -> str:
+        """Identify a catalog by its metadata location and data path."""
+
+        psql_host = env.str("PSQL_CATALOG_HOST")
+        psql_port = env.str("PSQL_CATALOG_PORT")
+        psql_db = env.str("PSQL_CATALOG_DB")
+        psql_location = f"{psql_host}:{psql_port}/{psql_db}"
+
+        return f"{psql_location}\n{generate_attach_sql().get(catalog, catalog)}"
+
+    def table_snapshot_ids(self, catalog: str, schema: str) -> dict[str, int]:
+        """
+        Find the latest snapshot_id where each table or view in a schema was changed.
+
+        This is read directly from the DuckLake metadata catalog, by considering the
+        creation of the table, its column changes, as well as any added or removed
+        data files, delete files and inlined rows. Views can read from any table in
+        the catalog, so they are considered changed on every new catalog snapshot.
+        """
+
+        log.info("Querying table snapshot_ids for {}.{}", catalog, schema)
+        self.attach(catalog)
+
+        metadata = f'"__ducklake_metadata_{catalog}"."{catalog}"'
+
+        # Small inserts are inlined into per-table metadata tables, instead of files
+        inlined_tables = self.conn.sql(
+            f"""--sql
+            SELECT table_id, table_name
+            FROM {metadata}.ducklake_inlined_data_tables
+            """
+        ).fetchall()
+
+        inlined_changes = "".join(
+            f"""
+                UNION ALL
+
+                SELECT {table_id}, unnest([max(begin_snapshot), max(end_snapshot)])
+                FROM {metadata}."{inlined_table_name}"
+            """
+            for table_id, inlined_table_name in inlined_tables
+        )
+
+        rel = self.conn.sql(
+            f"""--sql
+            WITH changes AS (
+                SELECT table_id, begin_snapshot AS snapshot_id
+                FROM {metadata}.ducklake_table
+
+                UNION ALL
+
+                SELECT table_id, unnest([begin_snapshot, end_snapshot])
+                FROM {metadata}.ducklake_column
+
+                UNION ALL
+
+                SELECT table_id, unnest([begin_snapshot, end_snapshot])
+                FROM {metadata}.ducklake_data_file
+
+                UNION ALL
+
+                SELECT table_id, unnest([begin_snapshot, end_snapshot])
+                FROM {metadata}.ducklake_delete_file
+                {inlined_changes}
+            )
+            SELECT t.table_name, max(c.snapshot_id) AS snapshot_id
+            FROM {metadata}.ducklake_table AS t
+            JOIN {metadata}.ducklake_schema AS s
+                ON s.schema_id = t.schema_id
+            JOIN changes AS c
+                ON c.table_id = t.table_id
+            WHERE s.schema_name = $schema
+                AND s.end_snapshot IS NULL
+                AND t.end_snapshot IS NULL
+            GROUP BY t.table_name
+
+            UNION ALL
+
+            SELECT
+                v.view_name,
+                (SELECT max(snapshot_id) FROM {metadata}.ducklake_snapshot)
+            FROM {metadata}.ducklake_view AS v
+            JOIN {metadata}.ducklake_schema AS s
+                ON s.schema_id = v.schema_id
+            WHERE s.schema_name = $schema
+                AND s.end_snapshot IS NULL
+                AND v.end_snapshot IS NULL
+            """,
+            params=dict(schema=schema),
+        )
+
+        return dict(rel.fetchall())
+
+    def is_view(self, catalog: str, schema: str, table_name: str) -> bool:
+        self.attach(catalog)
+
+        self.conn.execute(
+            """
+            SELECT count(*)
+            FROM information_schema.tables
+            WHERE table_catalog = ?
+                AND table_schema = ?
+                AND table_name = ?
+                AND table_type = 'VIEW'
+            """,
+            (catalog, schema, table_name),
+        )
+
+        return self.conn.fetchone()[0] > 0
+
     def schema(
         self,
         catalog: str,
@@ -150,6 +682,7 @@ class Lakehouse:
         table_name: str,
     ) -> list[dict[str, str]]:
         log.info("Reading schema for {}.{}.{}", catalog, schema, table_name)
+        self.attach(catalog)
 
         self.conn.execute(
             f"""--sql
@@ -171,6 +704,7 @@ class Lakehouse:
         where: str | None = None,
     ) -> int:
         log.info("Counting rows in for {}.{}.{}", catalog, schema, table_name)
+        self.attach(catalog)
 
         query = f"""--sql
             SELECT count(*)
@@ -194,20 +728,17 @@ class Lakehouse:
     # Dataset Loading
     # ---------------
 
-    def ml_load_train_set(
+    def _ml_train_set_rel(
         self,
+        conn: duckdb.DuckDBPyConnection,
         catalog: str,
         schema: str,
         table_name: str,
-        k_folds: Literal[3, 5, 10] = 3,
-    ) -> pd.DataFrame:
-        log.info(
-            "Loading train set from {}.{}.{} (k_folds={})",
-            catalog,
-            schema,
-            table_name,
-            k_folds,
-        )
+        k_folds: Literal[3, 5, 10],
+        snapshot_id: Optional[int] = None,
+    ) -> duckdb.DuckDBPyRelation:
+        self.attach(catalog)
+        at_clause = "" if snapshot_id is None else f"AT (VERSION => {snapshot_id})"
 
         match k_folds:
             case 3 | 5 | 10:
@@ -215,67 +746,70 @@ class Lakehouse:
             case _:
                 raise ValueError(f"Unsupported number of folds: {k_folds}")
 
-        rel = self.conn.sql(
+        return conn.sql(
             f"""--sql
             SELECT example_id, input, target, {folds_col} AS fold_id
-            FROM "{catalog}"."{schema}"."{table_name}"
+            FROM "{catalog}"."{schema}"."{table_name}" {at_clause}
             WHERE NOT is_test
             """
         )
 
-        return rel.to_df()
-
-    def ml_load_test_set(
+    def _ml_test_set_rel(
         self,
+        conn: duckdb.DuckDBPyConnection,
         catalog: str,
         schema: str,
         table_name: str,
-    ) -> pd.DataFrame:
-        log.info("Loading test set from {}.{}.{}", catalog, schema, table_name)
+        snapshot_id: Optional[int] = None,
+    ) -> duckdb.DuckDBPyRelation:
+        self.attach(catalog)
+        at_clause = "" if snapshot_id is None else f"AT (VERSION => {snapshot_id})"
 
-        rel = self.conn.sql(
+        return conn.sql(
             f"""--sql
             SELECT example_id, input, target
-            FROM "{catalog}"."{schema}"."{table_name}"
+            FROM "{catalog}"."{schema}"."{table_name}" {at_clause}
             WHERE is_test
             """
         )
 
-        return rel.to_df()
-
-    def ml_load_dataset(
+    def _ml_dataset_rel(
         self,
+        conn: duckdb.DuckDBPyConnection,
         catalog: str,
         schema: str,
         table_name: str,
-    ) -> pd.DataFrame:
-        log.info("Loading dataset from {}.{}.{}", catalog, schema, table_name)
+        snapshot_id: Optional[int] = None,
+    ) -> duckdb.DuckDBPyRelation:
+        self.attach(catalog)
+        at_clause = "" if snapshot_id is None else f"AT (VERSION => {snapshot_id})"
 
-        rel = self.conn.sql(
+        return conn.sql(
             f"""--sql
             SELECT example_id, input, target
-            FROM "{catalog}"."{schema}"."{table_name}"
+            FROM "{catalog}"."{schema}"."{table_name}" {at_clause}
             """
         )
 
-        return rel.to_df()
-
-    def ml_load_inferences(
+    def _ml_inferences_rel(
         self,
+        conn: duckdb.DuckDBPyConnection,
         catalog: str,
         schema: str,
         table_name: str,
         since: datetime | None,
         until: datetime | None,
-    ) -> pd.DataFrame:
-        log.info(
-            "Loading inference results from {}.{}.{}, since {}, until {}",
-            catalog,
-            schema,
-            table_name,
-            "the beginning" if since is None else since,
-            "the end" if until is None else until,
-        )
+    ) -> duckdb.DuckDBPyRelation:
+        self.attach(catalog)
+
+        # Deployments upgraded before any new writes don't have the view yet, so it's
+        # only created when missing, instead of issuing DDL on every read
+        if (
+            catalog == "secure_stage"
+            and table_name == "inferences"
+            and not self.is_view(catalog, schema, table_name)
+        ):
+            self._ml_inference_setup(schema)
 
         table_fqn = f'"{catalog}"."{schema}"."{table_name}"'
 
@@ -289,7 +823,8 @@ class Lakehouse:
             "created_at",
         ]
 
-        rel = self.conn.table(table_fqn).select(*col_list)
+        # Unlike conn.table, this also supports views
+        rel = conn.sql(f"FROM {table_fqn}").select(*col_list)
 
         if since is not None:
             rel = rel.filter(ColumnExpression("created_at") >= since)
@@ -297,22 +832,340 @@ class Lakehouse:
         if until is not None:
             rel = rel.filter(ColumnExpression("created_at") <= until)
 
-        return rel.to_df()
+        return rel
 
-    # Output Storing
-    # --------------
+    def _ml_cached_df(
+        self,
+        catalog: str,
+        schema: str,
+        table_name: str,
+        rel_fn: Callable[
+            [duckdb.DuckDBPyConnection, Optional[int]],
+            duckdb.DuckDBPyRelation,
+        ],
+    ) -> pd.DataFrame:
+        """
+        Materialize a relation, serving it from a local parquet file when the same
+        query was already run for the current snapshot of the table. The relation is
+        read at that snapshot, so that cached results always match their key.
+        """
 
-    def ml_inference_insert_results(
+        if not ML_CACHE or catalog in ML_CACHE_EXCLUDED_CATALOGS:
+            return rel_fn(self.conn, None).to_df()
+
+        snapshot_id = self.table_snapshot_ids(catalog, schema).get(table_name)
+
+        if snapshot_id is None:
+            log.warning(
+                "No snapshot found for {}.{}.{}, skipping cache",
+                catalog,
+                schema,
+                table_name,
+            )
+            return rel_fn(self.conn, None).to_df()
+
+        # Views can't be read at a snapshot, so results wouldn't match their key
+        if self.is_view(catalog, schema, table_name):
+            log.info("Skipping cache for view {}.{}.{}", catalog, schema, table_name)
+            return rel_fn(self.conn, None).to_df()
+
+        rel = rel_fn(self.conn, snapshot_id)
+
+        # The query covers the table, as well as any column projections and filters,
+        # while the catalog identity keeps lakehouses sharing a catalog name apart
+        key = hashlib.sha256(
+            json.dumps(
+                dict(
+                    catalog=self._catalog_identity(catalog),
+                    query=rel.sql_query(),
+                    snapshot_id=snapshot_id,
+                )
+            ).encode()
+        ).hexdigest()
+
+        cache_path = get_cache_dir() / "lakehouse" / catalog / f"{key}.parquet"
+
+        if cache_path.exists():
+            log.info("Using cached query results: {}", cache_path)
+
+            try:
+                df = self.conn.read_parquet(str(cache_path)).to_df()
+            except (duckdb.IOException, duckdb.InvalidInputException):
+                # Evicted by another process after the existence check
+                log.warning("Cached query results were evicted: {}", cache_path)
+            else:
+                record_hit("lakehouse")
+                touch(cache_path)
+                return df
+
+        log.info("Caching query results for snapshot {}: {}", snapshot_id, cache_path)
+        record_miss("lakehouse")
+
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_cache_path = cache_path.with_suffix(f".{os.getpid()}.tmp")
+
+        rel.write_parquet(str(tmp_cache_path))
+
+        # Read before publishing, as quota enforcement might evict the new file
+        df = self.conn.read_parquet(str(tmp_cache_path)).to_df()
+
+        os.replace(tmp_cache_path, cache_path)
+
+        record_write("lakehouse", cache_path.stat().st_size)
+        enforce_quota("lakehouse")
+
+        return df
+
+    def _ml_iter(
         self,
+        rel_fn: Callable[[duckdb.DuckDBPyConnection], duckdb.DuckDBPyRelation],
+        batch_size: int,
+        columns: Optional[list[str]],
+        where: Optional[str],
+    ) -> Iterator[pd.DataFrame]:
+        # A dedicated cursor keeps the stream valid while other queries are running
+        with self.conn.cursor() as cursor:
+            rel = rel_fn(cursor)
+
+            # Projections and filters are pushed down into the table scan by DuckDB
+            if where is not None:
+                rel = rel.filter(where)
+
+            if columns is not None:
+                rel = rel.select(*columns)
+
+            reader = rel.fetch_record_batch(batch_size)
+
+            for batch in reader:
+                yield batch.to_pandas()
+
+    def ml_load_train_set(
+        self,
+        catalog: str,
         schema: str,
-        inference_results: list[InferenceResult],
-    ):
+        table_name: str,
+        k_folds: Literal[3, 5, 10] = 3,
+    ) -> pd.DataFrame:
         log.info(
-            "Logging {} inference results for schema {}",
-            len(inference_results),
+            "Loading train set from {}.{}.{} (k_folds={})",
+            catalog,
+            schema,
+            table_name,
+            k_folds,
+        )
+
+        return self._ml_cached_df(
+            catalog,
+            schema,
+            table_name,
+            lambda conn, snapshot_id: self._ml_train_set_rel(
+                conn,
+                catalog,
+                schema,
+                table_name,
+                k_folds,
+                snapshot_id,
+            ),
+        )
+
+    def ml_iter_train_set(
+        self,
+        catalog: str,
+        schema: str,
+        table_name: str,
+        k_folds: Literal[3, 5, 10] = 3,
+        batch_size: int = ML_BATCH_SIZE,
+        columns: Optional[list[str]] = None,
+        where: Optional[str] = None,
+    ) -> Iterator[pd.DataFrame]:
+        log.info(
+            "Streaming train set from {}.{}.{} (k_folds={}, batch_size={})",
+            catalog,
+            schema,
+            table_name,
+            k_folds,
+            batch_size,
+        )
+
+        yield from self._ml_iter(
+            lambda conn: self._ml_train_set_rel(
+                conn,
+                catalog,
+                schema,
+                table_name,
+                k_folds,
+            ),
+            batch_size,
+            columns,
+            where,
+        )
+
+    def ml_load_test_set(
+        self,
+        catalog: str,
+        schema: str,
+        table_name: str,
+    ) -> pd.DataFrame:
+        log.info("Loading test set from {}.{}.{}", catalog, schema, table_name)
+
+        return self._ml_cached_df(
+            catalog,
+            schema,
+            table_name,
+            lambda conn, snapshot_id: self._ml_test_set_rel(
+                conn,
+                catalog,
+                schema,
+                table_name,
+                snapshot_id,
+            ),
+        )
+
+    def ml_iter_test_set(
+        self,
+        catalog: str,
+        schema: str,
+        table_name: str,
+        batch_size: int = ML_BATCH_SIZE,
+        columns: Optional[list[str]] = None,
+        where: Optional[str] = None,
+    ) -> Iterator[pd.DataFrame]:
+        log.info(
+            "Streaming test set from {}.{}.{} (batch_size={})",
+            catalog,
+            schema,
+            table_name,
+            batch_size,
+        )
+
+        yield from self._ml_iter(
+            lambda conn: self._ml_test_set_rel(conn, catalog, schema, table_name),
+            batch_size,
+            columns,
+            where,
+        )
+
+    def ml_load_dataset(
+        self,
+        catalog: str,
+        schema: str,
+        table_name: str,
+    ) -> pd.DataFrame:
+        log.info("Loading dataset from {}.{}.{}", catalog, schema, table_name)
+
+        return self._ml_cached_df(
+            catalog,
+            schema,
+            table_name,
+            lambda conn, snapshot_id: self._ml_dataset_rel(
+                conn,
+                catalog,
+                schema,
+                table_name,
+                snapshot_id,
+            ),
+        )
+
+    def ml_iter_dataset(
+        self,
+        catalog: str,
+        schema: str,
+        table_name: str,
+        batch_size: int = ML_BATCH_SIZE,
+        columns: Optional[list[str]] = None,
+        where: Optional[str] = None,
+    ) -> Iterator[pd.DataFrame]:
+        log.info(
+            "Streaming dataset from {}.{}.{} (batch_size={})",
+            catalog,
             schema,
+            table_name,
+            batch_size,
+        )
+
+        yield from self._ml_iter(
+            lambda conn: self._ml_dataset_rel(conn, catalog, schema, table_name),
+            batch_size,
+            columns,
+            where,
+        )
+
+    def ml_load_inferences(
+        self,
+        catalog: str,
+        schema: str,
+        table_name: str,
+        since: datetime | None,
+        until: datetime | None,
+    ) -> pd.DataFrame:
+        log.info(
+            "Loading inference results from {}.{}.{}, since {}, until {}",
+            catalog,
+            schema,
+            table_name,
+            "the beginning" if since is None else since,
+            "the end" if until is None else until,
+        )
+
+        rel = self._ml_inferences_rel(
+            self.conn,
+            catalog,
+            schema,
+            table_name,
+            since,
+            until,
+        )
+
+        return rel.to_df()
+
+    def ml_iter_inferences(
+        self,
+        catalog: str,
+        schema: str,
+        table_name: str,
+        since: datetime | None,
+        until: datetime | None,
+        batch_size: int = ML_BATCH_SIZE,
+        columns: Optional[list[str]] = None,
+        where: Optional[str] = None,
+    ) -> Iterator[pd.DataFrame]:
+        log.info(
+            "Streaming inference results from {}.{}.{}, since {}, until {} "
+            "(batch_size={})",
+            catalog,
+            schema,
+            table_name,
+            "the beginning" if since is None else since,
+            "the end" if until is None else until,
+            batch_size,
         )
 
+        yield from self._ml_iter(
+            lambda conn: self._ml_inferences_rel(
+                conn,
+                catalog,
+                schema,
+                table_name,
+                since,
+                until,
+            ),
+            batch_size,
+            columns,
+            where,
+        )
+
+    # Output Storing
+    # --------------
+
+    def _ml_inference_setup(self, schema: str):
+        # Extensions and tables only need to be set up once per shared connection
+        with _lakehouse_lock:
+            if schema in _lakehouse_ml_inference_schemas[self._key]:
+                return
+
+        log.info("Setting up inference results table for schema {}", schema)
+        self.attach("secure_stage")
+
         self.conn.execute("INSTALL json")
         self.conn.execute("LOAD json")
 
@@ -336,31 +1189,99 @@ class Lakehouse:
             """
         )
 
-        self.conn.executemany(
+        # Feedback is append-only, so that data files are never rewritten
+        self.conn.execute(
             f"""--sql
-            INSERT INTO secure_stage."{schema}".inference_results (
-                inference_uuid,
-                model_name,
-                model_version,
-                data,
-                prediction,
-                created_at
+            CREATE TABLE IF NOT EXISTS secure_stage."{schema}".inference_feedback (
+                inference_uuid VARCHAR NOT NULL,
+                feedback DOUBLE NOT NULL,
+                seq BIGINT NOT NULL,
+                created_at TIMESTAMP NOT NULL
             )
-            VALUES (?, ?, ?, ?, ?, make_timestamp(?))
-            """,
-            [
-                [
-                    inference_result.inference_uuid,
-                    inference_result.model.name,
-                    inference_result.model.version,
-                    json.dumps(inference_result.data),
-                    inference_result.prediction,
-                    inference_result.created_at,
-                ]
-                for inference_result in inference_results
-            ],
+            """
         )
 
+        # Legacy feedback, stored within inference_results, is kept in front
+        self.conn.execute(
+            f"""--sql
+            CREATE VIEW IF NOT EXISTS secure_stage."{schema}".inferences AS
+            WITH feedback AS (
+                SELECT
+                    inference_uuid,
+                    list(feedback ORDER BY created_at, seq) AS feedback
+                FROM secure_stage."{schema}".inference_feedback
+                GROUP BY inference_uuid
+            )
+            SELECT
+                r.inference_uuid,
+                r.model_name,
+                r.model_version,
+                r.data,
+                r.prediction,
+                CASE
+                    WHEN r.feedback IS NULL AND f.feedback IS NULL THEN NULL
+                    ELSE list_concat(r.feedback, f.feedback)
+                END AS feedback,
+                r.created_at
+            FROM secure_stage."{schema}".inference_results AS r
+            LEFT JOIN feedback AS f
+                ON f.inference_uuid = r.inference_uuid
+            """
+        )
+
+        with _lakehouse_lock:
+            _lakehouse_ml_inference_schemas[self._key].add(schema)
+
+    def ml_inference_insert_results(
+        self,
+        schema: str,
+        inference_results: list[InferenceResult],
+    ):
+        log.info(
+            "Logging {} inference results for schema {}",
+            len(inference_results),
+            schema,
+        )
+
+        self._ml_inference_setup(schema)
+
+        batch = pd.DataFrame(
+            dict(
+                inference_uuid=[r.inference_uuid for r in inference_results],
+                model_name=[r.model.name for r in inference_results],
+                model_version=[r.model.version for r in inference_results],
+                data=[json.dumps(r.data) for r in inference_results],
+                prediction=[r.prediction for r in inference_results],
+                created_at=[r.created_at for r in inference_results],
+            )
+        )
+
+        self.conn.register("inference_results_batch", batch)
+
+        try:
+            self.conn.execute(
+                f"""--sql
+                INSERT INTO secure_stage."{schema}".inference_results (
+                    inference_uuid,
+                    model_name,
+                    model_version,
+                    data,
+                    prediction,
+                    created_at
+                )
+                SELECT
+                    inference_uuid,
+                    model_name,
+                    model_version,
+                    data::JSON,
+                    prediction,
+                    make_timestamp(created_at)
+                FROM inference_results_batch
+                """
+            )
+        finally:
+            self.conn.unregister("inference_results_batch")
+
     def ml_inference_append_feedback(
         self,
         schema: str,
@@ -372,26 +1293,38 @@ class Lakehouse:
             schema,
         )
 
-        self.conn.execute("BEGIN TRANSACTION")
+        self._ml_inference_setup(schema)
 
-        try:
-            for feedback in inference_feedback:
-                self.conn.execute(
-                    f"""
-                    UPDATE secure_stage."{schema}".inference_results AS old
-                    SET feedback = list_append(old.feedback, ?)
-                    WHERE old.inference_uuid = ?
-                    """,
-                    [feedback.feedback, feedback.inference_uuid],
-                )
-            self.conn.execute("COMMIT")
+        # Timestamps are in UTC, like inference results, so that feedback is ordered
+        # consistently across servers and DST changes
+        created_at = int(datetime.now(timezone.utc).timestamp() * 1_000_000)
 
-        except:
-            self.conn.execute("ROLLBACK")
-            raise
+        # Arrival order within the batch is kept by seq, for read-time aggregation
+        batch = pd.DataFrame(
+            dict(
+                inference_uuid=[f.inference_uuid for f in inference_feedback],
+                feedback=[f.feedback for f in inference_feedback],
+                seq=range(len(inference_feedback)),
+                created_at=created_at,
+            )
+        )
+
+        self.conn.register("inference_feedback_batch", batch)
+
+        try:
+            self.conn.execute(
+                f"""--sql
+                INSERT INTO secure_stage."{schema}".inference_feedback
+                SELECT inference_uuid, feedback, seq, make_timestamp(created_at)
+                FROM inference_feedback_batch
+                """
+            )
+        finally:
+            self.conn.unregister("inference_feedback_batch")
 
     def ml_monitoring_store(self, schema: str, stats: pd.DataFrame):
         log.info("Storing model monitoring statistics for schema {}", schema)
+        self.attach("stage")
         data = stats.stack(level=0, future_stack=True).reset_index()
 
         data["model_name"] = data.model_uri.apply(lambda d: d.split("/")[1])
@@ -417,5 +1350,6 @@ class Lakehouse:
 
     def ml_monitoring_load(self, schema: str) -> pd.DataFrame:
         log.info("Loading model monitoring statistics for schema {}", schema)
+        self.attach("stage")
         result = self.conn.sql(f"""SELECT * FROM stage."{schema}".stats""")
         return result.to_df()
@@ -1,19 +1,47 @@
+import hashlib
 import json
 import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
 from datetime import datetime, timezone
 from enum import Enum
 from fnmatch import fnmatch
-from typing import Any, Iterable, Optional
+from pathlib import Path
+from typing import Any, Callable, Iterable, Optional
 
 import boto3
+import humanize
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import ClientError
 from loguru import logger as log
-from mypy_boto3_s3.service_resource import Bucket
+from mypy_boto3_s3.service_resource import Bucket, S3ServiceResource
+from tqdm import tqdm
 
+from shared.cache import get_cache_dir, record_hit, record_miss
 from shared.settings import env
 from shared.utils import fn_sanitize
 
 MANIFEST = "manifest.json"
-IGNORE_PATTERNS = (".keep", "README", "*.md", MANIFEST)
+INDEX = "index.json"
+IGNORE_PATTERNS = (".keep", "README", "*.md", MANIFEST, INDEX)
+
+S3_TRANSFER_MAX_WORKERS = env.int("S3_TRANSFER_MAX_WORKERS", 8)
+S3_TRANSFER_MAX_CONCURRENCY = env.int("S3_TRANSFER_MAX_CONCURRENCY", 4)
+S3_TRANSFER_CHUNK_SIZE_MB = env.int("S3_TRANSFER_CHUNK_SIZE_MB", 16)
+S3_TRANSFER_MAX_RETRIES = env.int("S3_TRANSFER_MAX_RETRIES", 3)
+S3_TRANSFER_BACKOFF_SECONDS = env.float("S3_TRANSFER_BACKOFF_SECONDS", 1.0)
+S3_LIST_MAX_WORKERS = env.int("S3_LIST_MAX_WORKERS", 8)
+S3_MAX_POOL_CONNECTIONS = env.int("S3_MAX_POOL_CONNECTIONS", 32)
+S3_INDEX_MAX_ATTEMPTS = env.int("S3_INDEX_MAX_ATTEMPTS", 10)
+
+_s3_lock = threading.Lock()
+_s3_session: Optional[boto3.session.Session] = None
+_s3_resources: dict[tuple[Optional[str], str, str, str], S3ServiceResource] = {}
+_s3_existing_buckets: set[tuple[Optional[str], str]] = set()
 
 
 class StoragePrefix(Enum):
@@ -22,9 +50,215 @@ class StoragePrefix(Enum):
     BACKUPS = 3
 
 
+def get_s3_resource(
+    endpoint: Optional[str],
+    access_key: str,
+    secret_key: str,
+    region: str,
+) -> S3ServiceResource:
+    """
+    Return the process-wide S3 resource for the given endpoint and credentials.
+
+    The underlying client, and its connection pool, is thread-safe and shared by all
+    Storage instances using the same configuration.
+    """
+
+    global _s3_session
+
+    key = (endpoint, access_key, secret_key, region)
+
+    with _s3_lock:
+        if key not in _s3_resources:
+            log.debug("Creating pooled S3 client for {}", endpoint or "AWS")
+
+            if _s3_session is None:
+                _s3_session = boto3.session.Session()
+
+            _s3_resources[key] = _s3_session.resource(
+                "s3",
+                endpoint_url=endpoint,
+                aws_access_key_id=access_key,
+                aws_secret_access_key=secret_key,
+                region_name=region,
+                config=Config(max_pool_connections=S3_MAX_POOL_CONNECTIONS),
+            )
+
+        return _s3_resources[key]
+
+
+def ensure_bucket(s3: S3ServiceResource, bucket_name: str):
+    key = (s3.meta.client.meta.endpoint_url, bucket_name)
+
+    if key in _s3_existing_buckets:
+        return
+
+    try:
+        s3.meta.client.head_bucket(Bucket=bucket_name)
+    except ClientError:
+        raise FileNotFoundError(f"Bucket does not exist: {bucket_name}")
+
+    with _s3_lock:
+        _s3_existing_buckets.add(key)
+
+
+@dataclass
+class TransferTask:
+    local_path: str
+    key: str
+    size: int
+    source_key: Optional[str] = None
+
+
+def file_checksum(path: str, chunk_size: int = 1024**2) -> str:
+    sha256 = hashlib.sha256()
+
+    with open(path, "rb") as fp:
+        while chunk := fp.read(chunk_size):
+            sha256.update(chunk)
+
+    return sha256.hexdigest()
+
+
+class TransferProgress:
+    """
+    Forward transferred bytes to a progress callback, keeping track of them, so that
+    they can be rolled back when a transfer is retried from scratch.
+    """
+
+    def __init__(self, callback: Optional[Callable[[int], Any]] = None):
+        self.callback = callback
+        self.num_bytes = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, num_bytes: int):
+        # Called from each of the transfer threads of a multipart transfer
+        with self.lock:
+            self.num_bytes += num_bytes
+
+        if self.callback is not None:
+            self.callback(num_bytes)
+
+    def reset(self):
+        with self.lock:
+            num_bytes = self.num_bytes
+            self.num_bytes = 0
+
+        if self.callback is not None and num_bytes > 0:
+            self.callback(-num_bytes)
+
+
+class MultipartWriter:
+    """
+    Write a stream of bytes into an S3 object, one multipart upload part at a time.
+
+    Only a single part is buffered in memory, so large files can be streamed into S3
+    without ever landing on local disk.
+    """
+
+    def __init__(
+        self,
+        bucket: Bucket,
+        key: str,
+        part_size: int,
+        retry: Optional[Callable[[Callable[[], Any], str], Any]] = None,
+    ):
+        self.client = bucket.meta.client
+        self.bucket_name = bucket.name
+        self.key = key
+        self.part_size = max(part_size, 5 * 1024**2)
+        self.retry = retry or (lambda fn, description: fn())
+
+        self.buffer = bytearray()
+        self.parts = []
+        self.upload_id = None
+
+    def _upload_part(self):
+        if self.upload_id is None:
+            response = self.retry(
+                lambda: self.client.create_multipart_upload(
+                    Bucket=self.bucket_name,
+                    Key=self.key,
+                ),
+                self.key,
+            )
+
+            self.upload_id = response["UploadId"]
+
+        part_number = len(self.parts) + 1
+        body = bytes(self.buffer)
+
+        response = self.retry(
+            lambda: self.client.upload_part(
+                Bucket=self.bucket_name,
+                Key=self.key,
+                UploadId=self.upload_id,
+                PartNumber=part_number,
+                Body=body,
+            ),
+            f"{self.key} (part {part_number})",
+        )
+
+        self.parts.append(dict(ETag=response["ETag"], PartNumber=part_number))
+        self.buffer.clear()
+
+    def write(self, data: bytes):
+        self.buffer.extend(data)
+
+        if len(self.buffer) >= self.part_size:
+            self._upload_part()
+
+    def close(self):
+        if self.upload_id is None:
+            # Small files fit into a single request
+            body = bytes(self.buffer)
+
+            self.retry(
+                lambda: self.client.put_object(
+                    Bucket=self.bucket_name,
+                    Key=self.key,
+                    Body=body,
+                ),
+                self.key,
+            )
+
+            self.buffer.clear()
+            return
+
+        if len(self.buffer) > 0:
+            self._upload_part()
+
+        self.retry(
+            lambda: self.client.complete_multipart_upload(
+                Bucket=self.bucket_name,
+                Key=self.key,
+                UploadId=self.upload_id,
+                MultipartUpload=dict(Parts=self.parts),
+            ),
+            self.key,
+        )
+
+    def abort(self):
+        if self.upload_id is not None:
+            self.client.abort_multipart_upload(
+                Bucket=self.bucket_name,
+                Key=self.key,
+                UploadId=self.upload_id,
+            )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            log.warning("Aborting multipart upload for {}", self.key)
+            self.abort()
+
+
 class Storage:
     def __init__(self, prefix: StoragePrefix):
-        self.endpoint = env.str("S3_ENDPOINT", required=False)
+        self.endpoint = env.str("S3_ENDPOINT", default=None)
         self.use_ssl = env.bool("S3_USE_SSL", default=True)
         self.access_key = env.str("S3_ACCESS_KEY_ID")
         self.secret_key = env.str("S3_SECRET_ACCESS_KEY")
@@ -47,25 +281,28 @@ class Storage:
 
         log.debug("Using prefix: {}", self.prefix)
 
+        self.transfer_config = TransferConfig(
+            multipart_threshold=S3_TRANSFER_CHUNK_SIZE_MB * 1024**2,
+            multipart_chunksize=S3_TRANSFER_CHUNK_SIZE_MB * 1024**2,
+            max_concurrency=S3_TRANSFER_MAX_CONCURRENCY,
+        )
+
         self._bucket = None
 
     @property
     def bucket(self) -> Bucket:
         if self._bucket is None:
-            s3 = boto3.resource(
-                "s3",
-                endpoint_url=self.endpoint,
-                aws_access_key_id=self.access_key,
-                aws_secret_access_key=self.secret_key,
-                region_name=self.region,
+            s3 = get_s3_resource(
+                endpoint=self.endpoint,
+                access_key=self.access_key,
+                secret_key=self.secret_key,
+                region=self.region,
             )
 
-            bucket = s3.Bucket(env.str("S3_BUCKET"))
+            bucket_name = env.str("S3_BUCKET")
+            ensure_bucket(s3, bucket_name)
 
-            if bucket not in s3.buckets.all():
-                raise FileNotFoundError("Bucket does not exist: {}", bucket.name)
-
-            self._bucket = bucket
+            self._bucket = s3.Bucket(bucket_name)
 
         return self._bucket
 
@@ -101,10 +338,153 @@ class Storage:
 
         return s3_path
 
+    def _retry(self, fn: Callable[[], Any], description: str) -> Any:
+        for attempt in range(1, S3_TRANSFER_MAX_RETRIES + 2):
+            try:
+                return fn()
+            except Exception as e:
+                if attempt > S3_TRANSFER_MAX_RETRIES:
+                    raise
+
+                backoff = S3_TRANSFER_BACKOFF_SECONDS * 2 ** (attempt - 1)
+
+                log.warning(
+                    "Transfer failed for {} (attempt {}/{}), retrying in {}s: {}",
+                    description,
+                    attempt,
+                    S3_TRANSFER_MAX_RETRIES + 1,
+                    backoff,
+                    e,
+                )
+
+                time.sleep(backoff)
+
+    def _upload_task(self, task: TransferTask, callback: Optional[Callable] = None):
+        progress = TransferProgress(callback)
+
+        def upload():
+            progress.reset()
+
+            self.bucket.meta.client.upload_file(
+                Filename=task.local_path,
+                Bucket=self.bucket.name,
+                Key=task.key,
+                Callback=progress,
+                Config=self.transfer_config,
+            )
+
+        self._retry(upload, task.local_path)
+
+    def _download_task(self, task: TransferTask, callback: Optional[Callable] = None):
+        os.makedirs(os.path.dirname(task.local_path) or ".", exist_ok=True)
+
+        progress = TransferProgress(callback)
+
+        def download():
+            progress.reset()
+
+            self.bucket.meta.client.download_file(
+                Bucket=self.bucket.name,
+                Key=task.key,
+                Filename=task.local_path,
+                Callback=progress,
+                Config=self.transfer_config,
+            )
+
+        self._retry(download, task.key)
+
+    def _copy_task(self, task: TransferTask, callback: Optional[Callable] = None):
+        progress = TransferProgress(callback)
+
+        def copy():
+            progress.reset()
+
+            self.bucket.meta.client.copy(
+                CopySource={"Bucket": self.bucket.name, "Key": task.source_key},
+                Bucket=self.bucket.name,
+                Key=task.key,
+                Callback=progress,
+                Config=self.transfer_config,
+            )
+
+        self._retry(copy, task.source_key)
+
+    def _transfer(
+        self,
+        tasks: list[TransferTask],
+        transfer_fn: Callable[[TransferTask, Optional[Callable]], None],
+        desc: str,
+    ):
+        if len(tasks) == 0:
+            return
+
+        # Force bucket initialization before the workers share its (thread-safe) client
+        _ = self.bucket
+
+        total_bytes = sum(task.size for task in tasks)
+        max_workers = max(1, min(S3_TRANSFER_MAX_WORKERS, len(tasks)))
+
+        log.info(
+            "{} {} files ({}) using {} workers",
+            desc,
+            len(tasks),
+            humanize.naturalsize(total_bytes),
+            max_workers,
+        )
+
+        failed = []
+        start = time.perf_counter()
+
+        with (
+            tqdm(
+                total=total_bytes,
+                unit="B",
+                unit_scale=True,
+                unit_divisor=1024,
+                desc=desc,
+            ) as pb,
+            ThreadPoolExecutor(max_workers=max_workers) as executor,
+        ):
+            futures = {
+                executor.submit(transfer_fn, task, pb.update): task for task in tasks
+            }
+
+            for future in as_completed(futures):
+                task = futures[future]
+
+                try:
+                    future.result()
+                    log.debug("Transferred {} <-> {}", task.local_path, task.key)
+                except Exception as e:
+                    log.error("Could not transfer {}: {}", task.local_path, e)
+                    failed.append(task)
+
+        elapsed = time.perf_counter() - start
+        throughput = total_bytes / elapsed if elapsed > 0 else 0
+
+        log.info(
+            "{} completed: {} files ({}) in {:.2f}s ({}/s)",
+            desc,
+            len(tasks) - len(failed),
+            humanize.naturalsize(total_bytes),
+            elapsed,
+            humanize.naturalsize(throughput),
+        )
+
+        if len(failed) > 0:
+            raise IOError(f"{len(failed)} out of {len(tasks)} transfers failed")
+
     def upload_file(self, source_path: str, s3_target_path: str):
         log.info(f"Uploading {source_path} to {s3_target_path}")
         s3_target_prefix = self.from_s3_path(s3_target_path)
-        self.bucket.upload_file(Filename=source_path, Key=s3_target_prefix)
+
+        self._upload_task(
+            TransferTask(
+                local_path=source_path,
+                key=s3_target_prefix,
+                size=os.path.getsize(source_path),
+            )
+        )
 
     def upload_files(
         self,
@@ -114,20 +494,48 @@ class Storage:
     ):
         s3_target_prefix = self.from_s3_path(s3_target_path)
 
-        source_files = list(source_files)
-
-        log.info("Uploading {} files to {}", len(source_files), s3_target_path)
+        tasks = []
 
         for source_path in source_files:
             local_path = os.path.join(source_root, source_path)
-            log.info(f"Uploading {local_path} to {s3_target_path}/{source_path}")
 
-            self.bucket.upload_file(
-                Filename=local_path,
-                Key=f"{s3_target_prefix}/{source_path}",
+            tasks.append(
+                TransferTask(
+                    local_path=local_path,
+                    key=f"{s3_target_prefix}/{source_path}",
+                    size=os.path.getsize(local_path),
+                )
             )
 
+        log.info("Uploading {} files to {}", len(tasks), s3_target_path)
+
+        self._transfer(tasks, self._upload_task, desc="Uploading")
+
     def upload_dir(self, source_path: str, s3_target_path: str):
+        file_paths = []
+
+        for root, _, files in os.walk(source_path):
+            for file in files:
+                full_path = os.path.join(root, file)
+                relative_path = os.path.relpath(full_path, source_path)
+                file_paths.append(relative_path)
+
+        self.upload_files(source_path, file_paths, s3_target_path)
+
+    def sync_dir(
+        self,
+        ds_name: str,
+        source_path: str,
+        s3_target_path: str,
+    ) -> dict[str, dict[str, Any]]:
+        """
+        Upload a directory into a new prefix, reusing unchanged files from latest.
+
+        Files whose size and checksum match an entry in the previous manifest are
+        copied server-side from the previous latest prefix, while all other files are
+        uploaded. Returns the file index, which should be passed to upload_manifest().
+        """
+
         s3_target_prefix = self.from_s3_path(s3_target_path)
 
         file_paths = []
@@ -138,31 +546,102 @@ class Storage:
                 relative_path = os.path.relpath(full_path, source_path)
                 file_paths.append(relative_path)
 
-        log.info("Uploading {} files to {}", len(file_paths), s3_target_path)
+        log.info("Computing checksums for {} files in {}", len(file_paths), source_path)
+
+        with ThreadPoolExecutor(max_workers=S3_TRANSFER_MAX_WORKERS) as executor:
+            checksums = executor.map(
+                lambda fp: file_checksum(os.path.join(source_path, fp)),
+                file_paths,
+            )
+
+            files = {
+                file_path: dict(
+                    size=os.path.getsize(os.path.join(source_path, file_path)),
+                    sha256=checksum,
+                )
+                for file_path, checksum in zip(file_paths, checksums)
+            }
 
-        for file_path in file_paths:
-            local_path = os.path.join(source_path, file_path)
-            log.info(f"Uploading {local_path} to {s3_target_path}/{file_path}")
+        manifest = self.load_manifest(ds_name) or {}
+        prev_files = manifest.get("files", {})
+        prev_prefix = (
+            self.from_s3_path(manifest["latest"]) if "latest" in manifest else None
+        )
 
-            self.bucket.upload_file(
-                Filename=local_path,
-                Key=f"{s3_target_prefix}/{file_path}",
+        upload_tasks = []
+        copy_tasks = []
+
+        for file_path, file_meta in files.items():
+            task = TransferTask(
+                local_path=os.path.join(source_path, file_path),
+                key=f"{s3_target_prefix}/{file_path}",
+                size=file_meta["size"],
             )
 
+            if prev_prefix is not None and prev_files.get(file_path) == file_meta:
+                task.source_key = f"{prev_prefix}/{file_path}"
+                copy_tasks.append(task)
+            else:
+                upload_tasks.append(task)
+
+        log.info(
+            "Syncing {} files to {}: {} changed, {} unchanged",
+            len(files),
+            s3_target_path,
+            len(upload_tasks),
+            len(copy_tasks),
+        )
+
+        self._transfer(copy_tasks, self._copy_task, desc="Copying")
+        self._transfer(upload_tasks, self._upload_task, desc="Uploading")
+
+        return files
+
+    def multipart_writer(self, s3_target_path: str) -> MultipartWriter:
+        return MultipartWriter(
+            bucket=self.bucket,
+            key=self.from_s3_path(s3_target_path),
+            part_size=S3_TRANSFER_CHUNK_SIZE_MB * 1024**2,
+            retry=self._retry,
+        )
+
+    def copy(self, s3_source_path: str, s3_target_path: str):
+        log.info("Copying {} to {}", s3_source_path, s3_target_path)
+
+        self._copy_task(
+            TransferTask(
+                local_path=s3_source_path,
+                key=self.from_s3_path(s3_target_path),
+                size=0,
+                source_key=self.from_s3_path(s3_source_path),
+            )
+        )
+
+    def object_size(self, s3_path: str) -> int:
+        response = self.bucket.meta.client.head_object(
+            Bucket=self.bucket.name,
+            Key=self.from_s3_path(s3_path),
+        )
+
+        return response["ContentLength"]
+
+    def list_files(self, s3_dir_path: str) -> list[str]:
+        prefix = f"{self.from_s3_path(s3_dir_path).rstrip('/')}/"
+        return [self.to_s3_path(key) for key in sorted(self._list_keys(prefix))]
+
     def download_file(self, s3_source_path: str, target_path: str):
         s3_source_prefix = self.from_s3_path(s3_source_path)
 
         log.info("Downloading {} to {}", s3_source_path, target_path)
 
-        self.bucket.download_file(
-            Key=s3_source_prefix,
-            Filename=target_path,
+        self._download_task(
+            TransferTask(local_path=target_path, key=s3_source_prefix, size=0)
         )
 
     def download_dir(self, s3_source_path: str, target_path: str):
         s3_source_prefix = self.from_s3_path(s3_source_path)
 
-        count = 0
+        tasks = []
 
         for obj in self.bucket.objects.filter(Prefix=s3_source_prefix):
             relative_path = obj.key[len(s3_source_prefix) :]
@@ -171,30 +650,40 @@ class Storage:
                 continue
 
             local_path = os.path.join(target_path, relative_path.lstrip("/"))
-            os.makedirs(os.path.dirname(local_path), exist_ok=True)
 
-            log.info("Downloading {} to {}", self.to_s3_path(obj.key), local_path)
-            self.bucket.download_file(Key=obj.key, Filename=local_path)
-
-            count += 1
+            tasks.append(
+                TransferTask(local_path=local_path, key=obj.key, size=obj.size)
+            )
 
-        if count == 0:
+        if len(tasks) == 0:
             log.warning("No files were found in {}", s3_source_path)
+            return
+
+        log.info("Downloading {} files to {}", len(tasks), target_path)
+
+        self._transfer(tasks, self._download_task, desc="Downloading")
 
     def upload_manifest(
         self,
         ds_name: str,
         *,
         latest: str,
+        files: Optional[dict[str, dict[str, Any]]] = None,
+        **fields: Any,
     ):
         log.info("Setting latest for {} as {}", ds_name, latest)
 
-        data = json.dumps(
-            {
-                "dataset": ds_name,
-                "latest": latest,
-            }
-        )
+        manifest = {
+            "dataset": ds_name,
+            "latest": latest,
+        }
+
+        if files is not None:
+            manifest["files"] = files
+
+        manifest |= fields
+
+        data = json.dumps(manifest)
 
         self.bucket.put_object(
             Key=f"{self.prefix}/{ds_name}/{MANIFEST}",
@@ -202,6 +691,8 @@ class Storage:
             ContentType="application/json",
         )
 
+        self._update_index(ds_name, self._index_entry(manifest))
+
     def load_manifest(self, path: str) -> Optional[dict[str, Any]]:
         obj = self.bucket.Object(f"{self.prefix}/{path}/{MANIFEST}")
 
@@ -212,42 +703,225 @@ class Storage:
 
         return manifest
 
-    def latest_to_env(self):
-        s3_ingest_prefix = env.str("S3_INGEST_PREFIX")
+    # Manifest Index
+    # ==============
 
-        for obj in self.bucket.objects.all():
-            key_parts = obj.key.strip("/").split("/")
+    @property
+    def index_cache_path(self) -> Path:
+        return get_cache_dir() / "storage" / self.bucket.name / self.prefix / INDEX
 
-            if key_parts[0] != s3_ingest_prefix:
-                continue
+    def _list_keys(self, prefix: str) -> list[str]:
+        # Uses the client directly, as it is thread-safe, unlike resources
+        paginator = self.bucket.meta.client.get_paginator("list_objects_v2")
 
-            if key_parts[-1] != MANIFEST:
-                continue
+        keys = []
 
-            manifest = json.loads(obj.get().get("Body").read().decode("utf-8"))
+        for page in paginator.paginate(Bucket=self.bucket.name, Prefix=prefix):
+            keys.extend(obj["Key"] for obj in page.get("Contents", []))
 
-            data_objects = self.bucket.objects.filter(
-                Prefix=self.from_s3_path(manifest["latest"])
-            )
+        return keys
 
-            for data_obj in data_objects:
-                key_parts = os.path.splitext(data_obj.key)[0].split("/")
+    def _index_entry(self, manifest: dict[str, Any]) -> dict[str, Any]:
+        return {
+            "dataset": manifest["dataset"],
+            "latest": manifest["latest"],
+            "keys": self._list_keys(self.from_s3_path(manifest["latest"])),
+        }
 
-                is_ignorable = any(
-                    fnmatch(key_parts[-1], ignore_pattern)
-                    for ignore_pattern in IGNORE_PATTERNS
+    def _put_index(
+        self,
+        index: dict[str, dict[str, Any]],
+        etag: Optional[str] = None,
+        create: bool = False,
+    ) -> str:
+        """
+        Write the index, only if it still matches etag, or if it doesn't exist yet,
+        when create is set, returning the new ETag.
+        """
+
+        log.debug("Updating manifest index for {}", self.prefix)
+
+        conditions = {}
+
+        if etag is not None:
+            conditions["IfMatch"] = etag
+        elif create:
+            conditions["IfNoneMatch"] = "*"
+
+        response = self.bucket.meta.client.put_object(
+            Bucket=self.bucket.name,
+            Key=f"{self.prefix}/{INDEX}",
+            Body=json.dumps(index),
+            ContentType="application/json",
+            **conditions,
+        )
+
+        self.index_cache_path.unlink(missing_ok=True)
+
+        return response["ETag"]
+
+    def _update_index(self, ds_name: str, entry: dict[str, Any]):
+        """
+        Set the index entry for a dataset, using a conditional write, so that
+        concurrent updates are retried instead of overwriting each other.
+        """
+
+        for attempt in range(1, S3_INDEX_MAX_ATTEMPTS + 1):
+            index, etag = self._load_index()
+            index[ds_name] = entry
+
+            try:
+                self._put_index(index, etag=etag, create=etag is None)
+                return
+            except ClientError as e:
+                code = e.response.get("Error", {}).get("Code")
+
+                if (
+                    code
+                    not in ("412", "PreconditionFailed", "ConditionalRequestConflict")
+                    or attempt == S3_INDEX_MAX_ATTEMPTS
+                ):
+                    raise
+
+                log.warning(
+                    "Manifest index changed concurrently (attempt {}/{}), retrying",
+                    attempt,
+                    S3_INDEX_MAX_ATTEMPTS,
                 )
 
-                if is_ignorable:
-                    continue
+                self.index_cache_path.unlink(missing_ok=True)
+                time.sleep(S3_TRANSFER_BACKOFF_SECONDS * random.random())
 
-                env_prefix_parts = key_parts[:2] + [
-                    fn_sanitize(kp) for kp in key_parts[4:]
-                ]
+    def _rebuild_index(self) -> tuple[dict[str, dict[str, Any]], str]:
+        log.info("Rebuilding manifest index for {}", self.prefix)
+
+        manifest_keys = [
+            key
+            for key in self._list_keys(self.prefix)
+            if key.strip("/").split("/")[-1] == MANIFEST
+        ]
+
+        def resolve(manifest_key: str) -> dict[str, Any]:
+            response = self.bucket.meta.client.get_object(
+                Bucket=self.bucket.name,
+                Key=manifest_key,
+            )
+
+            manifest = json.loads(response["Body"].read().decode("utf-8"))
+
+            return self._index_entry(manifest)
+
+        with ThreadPoolExecutor(max_workers=S3_LIST_MAX_WORKERS) as executor:
+            entries = executor.map(resolve, sorted(manifest_keys))
+            index = {entry["dataset"]: entry for entry in entries}
+
+        etag = self._put_index(index)
+
+        return index, etag
+
+    def rebuild_index(self) -> dict[str, dict[str, Any]]:
+        index, _ = self._rebuild_index()
+        return index
+
+    def _load_index(self) -> tuple[dict[str, dict[str, Any]], str]:
+        cache_path = self.index_cache_path
+        cached = None
+
+        if cache_path.exists():
+            try:
+                cached = json.loads(cache_path.read_text())
+            except json.JSONDecodeError:
+                log.warning("Ignoring corrupted manifest index cache: {}", cache_path)
+
+        obj = self.bucket.Object(f"{self.prefix}/{INDEX}")
+
+        try:
+            if cached is None:
+                response = obj.get()
+            else:
+                response = obj.get(IfNoneMatch=cached["etag"])
+        except ClientError as e:
+            match e.response.get("Error", {}).get("Code"):
+                case "304" | "NotModified":
+                    log.debug("Using cached manifest index: {}", cache_path)
+                    record_hit("storage")
+                    return cached["index"], cached["etag"]
+                case "404" | "NoSuchKey":
+                    return self._rebuild_index()
+                case _:
+                    raise
+
+        index = json.loads(response.get("Body").read().decode("utf-8"))
+        record_miss("storage")
+
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        cache_path.write_text(json.dumps(dict(etag=response["ETag"], index=index)))
+
+        return index, response["ETag"]
+
+    def load_index(self) -> dict[str, dict[str, Any]]:
+        """
+        Load the manifest index for the current prefix.
+
+        A local copy is kept in the cache and revalidated using its ETag, so that an
+        unchanged index costs a single conditional GET. If no index exists yet, it is
+        rebuilt from the individual manifests.
+        """
+
+        index, _ = self._load_index()
+        return index
+
+    def _latest_keys(self, entry: dict[str, Any]) -> list[str]:
+        keys = entry.get("keys", [])
+
+        is_placeholder_only = all(
+            any(
+                fnmatch(key.split("/")[-1], ignore_pattern)
+                for ignore_pattern in IGNORE_PATTERNS
+            )
+            for key in keys
+        )
 
-                env_prefix = "__".join(env_prefix_parts).upper()
+        # Manually ingested datasets are populated after the manifest is uploaded
+        if is_placeholder_only:
+            keys = self._list_keys(self.from_s3_path(entry["latest"]))
 
-                os.environ[env_prefix] = self.to_s3_path(data_obj.key)
+        return keys
+
+    # Listing and Pruning
+    # ===================
+
+    def _latest_env_vars(self, entry: dict[str, Any]) -> dict[str, str]:
+        env_vars = {}
+
+        for key in self._latest_keys(entry):
+            key_parts = os.path.splitext(key)[0].split("/")
+
+            is_ignorable = any(
+                fnmatch(key_parts[-1], ignore_pattern)
+                for ignore_pattern in IGNORE_PATTERNS
+            )
+
+            if is_ignorable:
+                continue
+
+            env_prefix_parts = key_parts[:2] + [fn_sanitize(kp) for kp in key_parts[4:]]
+            env_prefix = "__".join(env_prefix_parts).upper()
+
+            env_vars[env_prefix] = self.to_s3_path(key)
+
+        return env_vars
+
+    def latest_to_env(self):
+        index = self.load_index()
+        entries = [index[ds_name] for ds_name in sorted(index)]
+
+        log.info("Resolving latest paths for {} datasets", len(entries))
+
+        with ThreadPoolExecutor(max_workers=S3_LIST_MAX_WORKERS) as executor:
+            # Results are merged in dataset order, so collisions resolve the same way
+            for env_vars in executor.map(self._latest_env_vars, entries):
+                os.environ.update(env_vars)
 
     def ls(
         self,
@@ -256,37 +930,31 @@ class Storage:
     ) -> dict[str, list[str]]:
         listing = {}
 
-        for obj in self.bucket.objects.filter(Prefix=self.prefix):
-            key_parts = obj.key.strip("/").split("/")
-
-            if key_parts[-1] != MANIFEST:
-                continue
-
-            manifest = json.loads(obj.get().get("Body").read().decode("utf-8"))
-
+        for entry in self.load_index().values():
             if include_all:
                 s3_dataset_path = "/".join(
-                    self.from_s3_path(manifest["latest"]).split("/")[:2]
+                    self.from_s3_path(entry["latest"]).split("/")[:2]
                 )
 
-                data_objects = self.bucket.objects.filter(Prefix=s3_dataset_path)
+                keys = [
+                    data_obj.key
+                    for data_obj in self.bucket.objects.filter(Prefix=s3_dataset_path)
+                ]
             else:
-                data_objects = self.bucket.objects.filter(
-                    Prefix=self.from_s3_path(manifest["latest"])
-                )
+                keys = self._latest_keys(entry)
 
-            listing[manifest["dataset"]] = []
+            listing[entry["dataset"]] = []
 
-            for data_obj in data_objects:
+            for key in keys:
                 is_ignorable = any(
-                    fnmatch(data_obj.key.split("/")[-1], ignore_pattern)
+                    fnmatch(key.split("/")[-1], ignore_pattern)
                     for ignore_pattern in IGNORE_PATTERNS
                 )
 
                 if is_ignorable:
                     continue
 
-                listing[manifest["dataset"]].append(data_obj.key)
+                listing[entry["dataset"]].append(key)
 
         if display:
             for dataset, files in listing.items():
@@ -302,19 +970,10 @@ class Storage:
         return listing
 
     def prune(self) -> int:
-        for obj in self.bucket.objects.filter(Prefix=self.prefix):
-            key_parts = obj.key.strip("/").split("/")
-
-            if key_parts[-1] != MANIFEST:
-                continue
-
-            manifest = json.loads(obj.get().get("Body").read().decode("utf-8"))
-
-            dataset_prefix = "/".join(
-                self.from_s3_path(manifest["latest"]).split("/")[:2]
-            )
+        for entry in self.load_index().values():
+            dataset_prefix = "/".join(self.from_s3_path(entry["latest"]).split("/")[:2])
 
-            latest_prefix = self.from_s3_path(manifest["latest"])
+            latest_prefix = self.from_s3_path(entry["latest"])
 
             for data_obj in self.bucket.objects.filter(Prefix=dataset_prefix):
                 if data_obj.key.startswith(latest_prefix):
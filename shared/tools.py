@@ -12,8 +12,8 @@ from shared.templates import (
 )
 
 
-def generate_init_sql(path: Optional[str] = None) -> Optional[str]:
-    log.info("Generating init SQL")
+def generate_attach_sql() -> dict[str, str]:
+    """Map each DuckLake catalog name to the SQL statement that attaches it."""
 
     log.info(
         "Found {} env vars for data mart DBs: {}",
@@ -26,7 +26,7 @@ def generate_init_sql(path: Optional[str] = None) -> Optional[str]:
         "PSQL_CATALOG_SECURE_STAGE_SCHEMA",
     ] + MART_SCHEMA_VARS
 
-    attachments_sql = []
+    attachments_sql = {}
 
     for varname in schema_vars:
         basename = varname.removeprefix("PSQL_CATALOG_").removesuffix("_SCHEMA")
@@ -46,7 +46,18 @@ def generate_init_sql(path: Optional[str] = None) -> Optional[str]:
             )
         )
 
-        attachments_sql.append(attachment_sql)
+        attachments_sql[env.str(varname)] = attachment_sql
+
+    return attachments_sql
+
+
+def generate_init_sql(
+    path: Optional[str] = None,
+    attach: bool = True,
+) -> Optional[str]:
+    log.info("Generating init SQL")
+
+    attachments_sql = list(generate_attach_sql().values()) if attach else []
 
     init_sql = reformat_render(
         INIT_SQL_TPL.substitute(
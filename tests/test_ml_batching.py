@@ -0,0 +1,247 @@
+import asyncio
+import threading
+from uuid import uuid4
+
+import pytest
+
+import ml.batching
+from ml.batching import InferenceBatcher, InferenceQueueFull
+from ml.types import (
+    InferenceModel,
+    InferenceRequest,
+    InferenceResult,
+    InvalidInferenceRequest,
+)
+
+MODEL = InferenceModel(name="stub", version="1")
+
+
+@pytest.fixture
+def batch_sizes(monkeypatch):
+    batch_sizes = []
+
+    def stub_predict_batch(inference_model, inference_requests):
+        batch_sizes.append(len(inference_requests))
+
+        for inference_request in inference_requests:
+            inference_request.validate()
+
+            if inference_request.data == "bad":
+                raise RuntimeError("Bad input")
+
+        return [
+            InferenceResult(
+                inference_uuid=str(uuid4()),
+                model=inference_model,
+                data=inference_request.data,
+                prediction=float(len(inference_request.data)),
+            )
+            for inference_request in inference_requests
+        ]
+
+    monkeypatch.setattr(ml.batching, "predict_batch", stub_predict_batch)
+
+    return batch_sizes
+
+
+@pytest.fixture
+def blocked_batches(monkeypatch):
+    """Hold every batch in the executor until the returned event is set."""
+
+    release = threading.Event()
+    lock = threading.Lock()
+    running = [0]
+    max_running = [0]
+
+    def stub_predict_batch(inference_model, inference_requests):
+        with lock:
+            running[0] += 1
+            max_running[0] = max(max_running[0], running[0])
+
+        release.wait(timeout=5)
+
+        with lock:
+            running[0] -= 1
+
+        return [
+            InferenceResult(
+                inference_uuid=str(uuid4()),
+                model=inference_model,
+                data=inference_request.data,
+                prediction=0.0,
+            )
+            for inference_request in inference_requests
+        ]
+
+    monkeypatch.setattr(ml.batching, "predict_batch", stub_predict_batch)
+
+    return release, max_running
+
+
+def run_batcher(batcher: InferenceBatcher, coro_fn):
+    async def main():
+        try:
+            return await coro_fn()
+        finally:
+            batcher.executor.shutdown(wait=True)
+
+    return asyncio.run(main())
+
+
+def test_requests_within_window_share_a_batch(batch_sizes):
+    batcher = InferenceBatcher(max_size=64, max_wait_ms=50)
+    data = ["a", "bb", "ccc"]
+
+    inference_results = run_batcher(
+        batcher,
+        lambda: asyncio.gather(
+            *(batcher.predict(InferenceRequest(models=MODEL, data=d)) for d in data)
+        ),
+    )
+
+    assert batch_sizes == [3]
+    assert [r.data for r in inference_results] == data
+    assert [r.prediction for r in inference_results] == [1.0, 2.0, 3.0]
+
+
+def test_full_batches_flush_without_waiting(batch_sizes):
+    batcher = InferenceBatcher(max_size=2, max_wait_ms=50)
+
+    inference_results = run_batcher(
+        batcher,
+        lambda: asyncio.gather(
+            *(
+                batcher.predict(InferenceRequest(models=MODEL, data="a" * n))
+                for n in range(1, 6)
+            )
+        ),
+    )
+
+    assert sorted(batch_sizes) == [1, 2, 2]
+    assert [r.prediction for r in inference_results] == [1.0, 2.0, 3.0, 4.0, 5.0]
+
+
+def test_failed_batch_only_fails_bad_requests(batch_sizes):
+    batcher = InferenceBatcher(max_size=64, max_wait_ms=50)
+    data = ["a", "bad", "ccc"]
+
+    inference_results = run_batcher(
+        batcher,
+        lambda: asyncio.gather(
+            *(batcher.predict(InferenceRequest(models=MODEL, data=d)) for d in data),
+            return_exceptions=True,
+        ),
+    )
+
+    assert batch_sizes == [3, 1, 1, 1]
+    assert inference_results[0].prediction == 1.0
+    assert isinstance(inference_results[1], RuntimeError)
+    assert inference_results[2].prediction == 3.0
+
+
+def test_empty_input_is_rejected_before_batching(batch_sizes):
+    batcher = InferenceBatcher(max_size=64, max_wait_ms=50)
+
+    with pytest.raises(InvalidInferenceRequest):
+        run_batcher(
+            batcher,
+            lambda: batcher.predict(InferenceRequest(models=MODEL, data="")),
+        )
+
+    assert batch_sizes == []
+
+
+def test_full_queue_rejects_with_retry_after(blocked_batches):
+    release, _ = blocked_batches
+    batcher = InferenceBatcher(max_size=1, max_wait_ms=50, max_pending=2)
+
+    async def main():
+        tasks = [
+            asyncio.create_task(
+                batcher.predict(InferenceRequest(models=MODEL, data="a"))
+            )
+            for _ in range(2)
+        ]
+
+        await asyncio.sleep(0.05)
+
+        with pytest.raises(InferenceQueueFull) as exc_info:
+            await batcher.predict(InferenceRequest(models=MODEL, data="a"))
+
+        assert exc_info.value.retry_after >= 1
+
+        release.set()
+        await asyncio.gather(*tasks)
+
+        # Once drained, requests are accepted again
+        return await batcher.predict(InferenceRequest(models=MODEL, data="a"))
+
+    assert run_batcher(batcher, main).prediction == 0.0
+
+
+def test_batches_per_model_are_limited_by_max_concurrency(blocked_batches):
+    release, max_running = blocked_batches
+    batcher = InferenceBatcher(max_size=1, max_wait_ms=50, max_concurrency=2)
+
+    async def main():
+        tasks = [
+            asyncio.create_task(
+                batcher.predict(InferenceRequest(models=MODEL, data="a"))
+            )
+            for _ in range(6)
+        ]
+
+        await asyncio.sleep(0.05)
+        release.set()
+
+        return await asyncio.gather(*tasks)
+
+    assert len(run_batcher(batcher, main)) == 6
+    assert max_running[0] == 2
+
+
+def test_predict_many_chunks_and_keeps_order(batch_sizes):
+    batcher = InferenceBatcher(max_size=3, max_wait_ms=50)
+    other_model = InferenceModel(name="stub", version="2")
+    inference_requests = [
+        InferenceRequest(models=MODEL if n % 2 else other_model, data="a" * n)
+        for n in range(1, 9)
+    ]
+
+    inference_results = run_batcher(
+        batcher,
+        lambda: batcher.predict_many(inference_requests),
+    )
+
+    assert sorted(batch_sizes) == [1, 1, 3, 3]
+    assert [r.prediction for r in inference_results] == [float(n) for n in range(1, 9)]
+    assert [r.model for r in inference_results] == [
+        r.models for r in inference_requests
+    ]
+
+
+def test_predict_many_rejects_batches_over_max_pending(batch_sizes):
+    batcher = InferenceBatcher(max_size=3, max_wait_ms=50, max_pending=4)
+    inference_requests = [InferenceRequest(models=MODEL, data="a") for _ in range(5)]
+
+    with pytest.raises(InferenceQueueFull):
+        run_batcher(batcher, lambda: batcher.predict_many(inference_requests))
+
+    assert batch_sizes == []
+
+
+def test_predict_many_isolates_failed_requests(batch_sizes):
+    batcher = InferenceBatcher(max_size=3, max_wait_ms=50)
+    data = ["a", "bad", "ccc", "dddd"]
+    inference_requests = [InferenceRequest(models=MODEL, data=d) for d in data]
+
+    inference_results = run_batcher(
+        batcher,
+        lambda: batcher.predict_many(inference_requests),
+    )
+
+    assert sorted(batch_sizes) == [1, 1, 1, 1, 3]
+    assert inference_results[0].prediction == 1.0
+    assert isinstance(inference_results[1], RuntimeError)
+    assert [r.prediction for r in inference_results[2:]] == [3.0, 4.0]
+    assert batcher.waiting[(MODEL.name, MODEL.version)] == 0
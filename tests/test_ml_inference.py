@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+import ml.inference
+from ml.inference import predict_batch, select_model
+from ml.types import InferenceModel, InferenceRequest, InvalidInferenceRequest
+
+
+class StubModel:
+    classes_ = np.array([0, 1])
+
+    def predict_proba(self, data):
+        # The positive class probability encodes the input length, so that each
+        # prediction can be traced back to its input row
+        pos = data["input"].str.len().to_numpy() / 100
+        return np.column_stack([1 - pos, pos])
+
+
+@pytest.fixture
+def inference_model(monkeypatch):
+    monkeypatch.setattr(ml.inference.model_registry, "get", lambda _: StubModel())
+    return InferenceModel(name="stub", version="1")
+
+
+def test_predict_batch_maps_rows_to_requests(inference_model):
+    inference_requests = [
+        InferenceRequest(models=inference_model, data="a" * n) for n in (3, 1, 7)
+    ]
+
+    inference_results = predict_batch(inference_model, inference_requests)
+
+    assert [r.data for r in inference_results] == [r.data for r in inference_requests]
+    assert [r.prediction for r in inference_results] == pytest.approx(
+        [0.03, 0.01, 0.07]
+    )
+    assert all(type(r.prediction) is float for r in inference_results)
+    assert len({r.inference_uuid for r in inference_results}) == 3
+
+
+def test_predict_batch_rejects_empty_input(inference_model):
+    inference_requests = [
+        InferenceRequest(models=inference_model, data="ok"),
+        InferenceRequest(models=inference_model, data="  "),
+    ]
+
+    with pytest.raises(InvalidInferenceRequest):
+        predict_batch(inference_model, inference_requests)
+
+
+def test_select_model_rejects_empty_models():
+    with pytest.raises(InvalidInferenceRequest):
+        select_model(InferenceRequest(models=[], data="ok"))
@@ -0,0 +1,109 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+import shared.cache
+from shared.cache import (
+    enforce_quota,
+    expunge_cache,
+    get_cache_dir,
+    load_stats,
+    namespace_size,
+    reconcile,
+    record_write,
+)
+
+MB = 1024**2
+
+
+@pytest.fixture
+def cache_dir(monkeypatch, tmp_path):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    monkeypatch.setattr(shared.cache, "CACHE_QUOTAS_MB", {"datacite": 2})
+    return get_cache_dir()
+
+
+def write_entry(cache_dir, name: str, size: int, last_used: float):
+    entry_path = cache_dir / "datacite" / "files" / name
+    entry_path.parent.mkdir(parents=True, exist_ok=True)
+    entry_path.write_bytes(b"\0" * size)
+    os.utime(entry_path, (last_used, last_used))
+    return entry_path
+
+
+def test_quota_evicts_least_recently_used_entries(cache_dir):
+    entry_paths = [
+        write_entry(cache_dir, f"entry_{i}", MB, last_used=1_000_000 + i)
+        for i in range(4)
+    ]
+
+    evicted_bytes = enforce_quota("datacite")
+
+    assert evicted_bytes == 2 * MB
+    assert [path.exists() for path in entry_paths] == [False, False, True, True]
+
+    ns_stats = load_stats()["datacite"]
+
+    assert ns_stats["evictions"] == 2
+    assert ns_stats["evicted_bytes"] == 2 * MB
+    assert namespace_size("datacite") == 2 * MB
+
+
+def test_quota_keeps_namespaces_within_budget(cache_dir):
+    entry_path = write_entry(cache_dir, "entry", MB, last_used=1_000_000)
+
+    assert enforce_quota("datacite") == 0
+    assert enforce_quota("unbounded") == 0
+    assert entry_path.exists()
+
+
+def test_ledger_tracks_writes_without_rescanning(cache_dir):
+    write_entry(cache_dir, "entry", MB, last_used=1_000_000)
+
+    assert reconcile("datacite") == MB
+
+    # Writes are recorded in the ledger, which isn't rescanned while fresh
+    record_write("datacite", 512)
+
+    assert namespace_size("datacite") == MB + 512
+
+
+def test_stale_ledger_is_reconciled(cache_dir, monkeypatch):
+    write_entry(cache_dir, "entry", MB, last_used=1_000_000)
+    reconcile("datacite")
+    record_write("datacite", 512)
+
+    monkeypatch.setattr(shared.cache, "CACHE_LEDGER_TTL_HOURS", -1)
+
+    assert namespace_size("datacite") == MB
+
+
+def test_expunged_namespace_is_reconciled(cache_dir):
+    write_entry(cache_dir, "entry", MB, last_used=1_000_000)
+    reconcile("datacite")
+
+    expunge_cache("datacite", "files")
+
+    assert namespace_size("datacite") == 0
+
+
+def test_ledger_updates_are_atomic_across_processes(cache_dir):
+    reconcile("datacite")
+
+    mp_context = multiprocessing.get_context("spawn")
+
+    with ProcessPoolExecutor(4, mp_context=mp_context) as executor:
+        list(executor.map(record_write, ["datacite"] * 200, [1] * 200))
+
+    assert load_stats()["datacite"]["bytes"] == 200
+
+
+def test_quota_skips_hidden_entries(cache_dir):
+    write_entry(cache_dir, "entry", 3 * MB, last_used=1_000_000)
+    hidden_path = write_entry(cache_dir, ".entry.tmp", MB, last_used=0)
+
+    enforce_quota("datacite")
+
+    assert hidden_path.exists()